@@ -1,37 +1,149 @@
 import argparse
+import asyncio
+import base64
+import collections
+import gzip
+import itertools
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import queue
 import random
+import re
+import socket
+import struct
+import sys
 import threading
 import time
 
 import redis
+import redis.asyncio
+from redis.cluster import RedisCluster
 from faker import Faker
+from redis.connection import parse_url
 from redis.commands.search.field import GeoField, NumericField, TagField, TextField
 from redis.commands.search.index_definition import IndexDefinition, IndexType
 from redis.commands.search.query import Query
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
 
 REDIS_KEY_BASE = "alon:shmuely:redis:data:store:application"
 INDEX_NAME = "idx:books"
 
 fake = Faker()
 
+EDITIONS = [
+    "english", "spanish", "french", "german", "italian", "chinese",
+    "japanese", "russian", "arabic", "portuguese", "korean", "dutch",
+    "swedish", "norwegian", "danish", "finnish", "polish", "turkish",
+    "hindi", "urdu", "greek", "hebrew", "thai", "vietnamese",
+    "indonesian", "hungarian", "czech", "slovak", "romanian",
+    "bulgarian", "ukrainian", "serbian", "croatian", "slovenian", "latvian"
+]
+GENRES = [
+    "comics (superheroes)", "fiction", "non-fiction", "science fiction",
+    "fantasy", "mystery", "romance", "history", "horror", "biography",
+    "thriller", "self-help", "poetry", "cookbooks", "memoir",
+    "young adult", "children's literature", "drama", "travel", "science",
+    "art", "philosophy", "psychology", "religion", "true crime",
+    "graphic novel", "adventure", "political", "health", "humor"
+]
+INVENTORY_STATUSES = ["available", "maintenance", "on_loan", "for_sale"]
+FORMATS = ["hardcover", "paperback", "ebook"]
+# Upper bound for generated timestamps; None means "now", --seed pins it so
+# seeded datasets do not depend on the wall clock.
+TIMESTAMP_END = None
+SEEDED_TIMESTAMP_END = 1700000000
+
 COUNTERS = {
     "data_verification_successful": 0,
     "data_verification_error": 0,
     "successful_write": 0,
     "unsuccessful_write": 0,
+    "ttl_set": 0,
+    "churn_delete": 0,
+    "churn_relist": 0,
+    "partial_update": 0,
+    "order_multi_commit": 0,
+    "order_watch_commit": 0,
+    "order_watch_conflict": 0,
+    "order_watch_gave_up": 0,
+    "order_out_of_stock": 0,
+    "id_insert": 0,
+    "id_overwrite": 0,
 }
 COUNTERS_LOCK = threading.Lock()
+COUNTER_NAMES = list(COUNTERS)
+COUNTER_SLOTS = []
+COUNTER_LOCAL = threading.local()
+SHARED_COUNTERS = None
+SHARED_ROLLING_P99 = None
+WRITE_LATENCIES = []
+LATENCY_HISTOGRAMS = []
 
 
 def increment_counter(name, amount=1):
-    with COUNTERS_LOCK:
-        COUNTERS[name] += amount
+    # Each thread counts into its own slot, which only it ever writes; the
+    # lock is taken once per thread to register the slot for the readers.
+    slot = getattr(COUNTER_LOCAL, "slot", None)
+    if slot is None:
+        slot = COUNTER_LOCAL.slot = dict.fromkeys(COUNTER_NAMES, 0)
+        with COUNTERS_LOCK:
+            COUNTER_SLOTS.append(slot)
+    slot[name] += amount
 
 
 def get_counters_snapshot():
     with COUNTERS_LOCK:
-        return dict(COUNTERS)
+        snapshot = dict(COUNTERS)
+        slots = list(COUNTER_SLOTS)
+        shared_counters = list(SHARED_COUNTERS) if SHARED_COUNTERS is not None else []
+
+    for slot in slots:
+        for name in COUNTER_NAMES:
+            snapshot[name] += slot[name]
+    for index, value in enumerate(shared_counters):
+        snapshot[COUNTER_NAMES[index % len(COUNTER_NAMES)]] += value
+    return snapshot
+
+
+def fold_shared_counters():
+    global SHARED_COUNTERS, SHARED_ROLLING_P99
+
+    with COUNTERS_LOCK:
+        if SHARED_COUNTERS is not None:
+            for index, value in enumerate(SHARED_COUNTERS):
+                COUNTERS[COUNTER_NAMES[index % len(COUNTER_NAMES)]] += value
+        SHARED_COUNTERS = None
+        SHARED_ROLLING_P99 = None
+
+
+def peak_memory_mb():
+    if resource is None:
+        return None, None
+
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return own, children
+
+
+def client_cpu_seconds():
+    # User and system time of this process plus the writer processes it has joined
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
 
 
 def make_key(book_id):
@@ -46,9 +158,33 @@ def create_redis_connection_pool(redis_url, max_connections):
     )
 
 
+def create_redis_cluster(redis_url, max_connections):
+    try:
+        return RedisCluster.from_url(
+            redis_url,
+            max_connections=max_connections,
+            decode_responses=True
+        )
+    except redis.exceptions.RedisClusterException as e:
+        raise redis.exceptions.ConnectionError(str(e)) from e
+
+
+def create_pool_from_args(args):
+    if args.cluster:
+        return create_redis_cluster(args.redis_url, args.max_connections)
+    return create_redis_connection_pool(args.redis_url, args.max_connections)
+
+
+def redis_client(connection_pool):
+    # With --cluster the pool is a RedisCluster, which keeps a pool per node
+    if isinstance(connection_pool, RedisCluster):
+        return connection_pool
+    return redis.Redis(connection_pool=connection_pool)
+
+
 def index_exists(connection_pool, index_name):
     try:
-        r = redis.Redis(connection_pool=connection_pool)
+        r = redis_client(connection_pool)
         r.ft(index_name).info()
         print(f"Search index '{index_name}' already exists.")
         return True
@@ -60,190 +196,856 @@ def index_exists(connection_pool, index_name):
         return False
 
 
+def search_index_schema():
+    fields = [
+        TextField("author", sortable=True),
+        TagField("id", sortable=True),
+        TextField("description"),
+        TagField("editions", separator="|", sortable=True),
+        TagField("genres", separator="|", sortable=True),
+        NumericField("pages", sortable=True),
+        TextField("title", sortable=True),
+        NumericField("year_published", sortable=True),
+        NumericField("rating_votes", sortable=True),
+        NumericField("score", sortable=True),
+        TagField("status", separator="|", sortable=True),
+        TagField("stock_id", separator="|", sortable=True),
+        TagField("format", sortable=True),
+        TagField("is_available", sortable=True),
+        NumericField("price", sortable=True),
+        TagField("isbn", sortable=True),
+        GeoField("geo"),
+        TextField("publisher", sortable=True),
+        TextField("book_series", sortable=True),
+        TextField("main_character", sortable=True),
+        TextField("location", sortable=True),
+        TextField("address"),
+        NumericField("edition_number", sortable=True),
+        NumericField("chapter_count", sortable=True),
+        NumericField("review_count", sortable=True),
+        NumericField("citation_count", sortable=True),
+        NumericField("publishing_delay", sortable=True),
+        NumericField("word_count", sortable=True),
+        NumericField("timestamp", sortable=True),
+        NumericField("reading_time_minutes", sortable=True),
+        NumericField("global_sales", sortable=True),
+        NumericField("translations_count", sortable=True),
+        NumericField("author_age_at_publication", sortable=True),
+        NumericField("weight_grams", sortable=True),
+        NumericField("width_cm", sortable=True),
+        NumericField("height_cm", sortable=True),
+        NumericField("depth_cm", sortable=True),
+    ]
+    definition = IndexDefinition(
+        index_type=IndexType.HASH,
+        prefix=[f"{REDIS_KEY_BASE}:"]
+    )
+    return fields, definition
+
+
+def ft_create_command():
+    fields, definition = search_index_schema()
+    command = ["FT.CREATE", INDEX_NAME, *definition.args, "SCHEMA"]
+    for field in fields:
+        command.extend(field.redis_args())
+    return [str(arg) for arg in command]
+
+
 def create_search_index(connection_pool):
     try:
-        r = redis.Redis(connection_pool=connection_pool)
+        r = redis_client(connection_pool)
 
         if index_exists(connection_pool, INDEX_NAME):
             print("Search index already exists.")
             return
 
         print("Creating search index.")
-        r.ft(INDEX_NAME).create_index(
-            [
-                TextField("author", sortable=True),
-                TagField("id", sortable=True),
-                TextField("description"),
-                TagField("editions", separator="|", sortable=True),
-                TagField("genres", separator="|", sortable=True),
-                NumericField("pages", sortable=True),
-                TextField("title", sortable=True),
-                NumericField("year_published", sortable=True),
-                NumericField("rating_votes", sortable=True),
-                NumericField("score", sortable=True),
-                TagField("status", separator="|", sortable=True),
-                TagField("stock_id", separator="|", sortable=True),
-                TagField("format", sortable=True),
-                TagField("is_available", sortable=True),
-                NumericField("price", sortable=True),
-                TagField("isbn", sortable=True),
-                GeoField("geo"),
-                TextField("publisher", sortable=True),
-                TextField("book_series", sortable=True),
-                TextField("main_character", sortable=True),
-                TextField("location", sortable=True),
-                TextField("address"),
-                NumericField("edition_number", sortable=True),
-                NumericField("chapter_count", sortable=True),
-                NumericField("review_count", sortable=True),
-                NumericField("citation_count", sortable=True),
-                NumericField("publishing_delay", sortable=True),
-                NumericField("word_count", sortable=True),
-                NumericField("timestamp", sortable=True),
-                NumericField("reading_time_minutes", sortable=True),
-                NumericField("global_sales", sortable=True),
-                NumericField("translations_count", sortable=True),
-                NumericField("author_age_at_publication", sortable=True),
-                NumericField("weight_grams", sortable=True),
-                NumericField("width_cm", sortable=True),
-                NumericField("height_cm", sortable=True),
-                NumericField("depth_cm", sortable=True),
-            ],
-            definition=IndexDefinition(
-                index_type=IndexType.HASH,
-                prefix=[f"{REDIS_KEY_BASE}:"]
-            )
-        )
+        fields, definition = search_index_schema()
+        r.ft(INDEX_NAME).create_index(fields, definition=definition)
     except redis.exceptions.ConnectionError as e:
         print(f"Failed to create search index. Error: {str(e)}")
 
 
-def generate_random_book(book_id):
+# Faker fields that dominate generate_random_book; with --vocab-pool-size they
+# are drawn by index from pools built once and cached per locale and seed.
+POOLED_FAKER_FIELDS = ["name", "first_name", "company", "city", "address", "isbn13", "url", "word"]
+
+
+class VocabularyPool:
+    def __init__(self, faker, pools, rng=random):
+        self.faker = faker
+        self.pools = pools
+        self.rng = rng
+        for field, values in pools.items():
+            setattr(self, field, self._sampler(values))
+
+    def _sampler(self, values):
+        size = len(values)
+        return lambda: values[int(self.rng.random() * size)]
+
+    def __getattr__(self, name):
+        return getattr(self.faker, name)
+
+
+def vocabulary_cache_path(cache_dir, locale, seed, size):
+    return os.path.join(cache_dir, f"vocab-{locale}-{seed}-{size}.json")
+
+
+def build_vocabulary_pools(locale, seed, size):
+    faker = Faker(locale)
+    faker.seed_instance(seed)
+    return {
+        field: [getattr(faker, field)() for _ in range(size)]
+        for field in POOLED_FAKER_FIELDS
+    }
+
+
+def load_vocabulary_pool(locale, seed, size, cache_dir, verbose=True):
+    start = time.perf_counter()
+    path = vocabulary_cache_path(cache_dir, locale, seed, size)
+    try:
+        with open(path, encoding="utf-8") as cache_file:
+            pools = json.load(cache_file)
+        source = f"loaded from {path}"
+    except (OSError, ValueError):
+        pools = build_vocabulary_pools(locale, seed, size)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as cache_file:
+            json.dump(pools, cache_file)
+        os.replace(tmp_path, path)
+        source = f"built and cached to {path}"
+
+    if verbose:
+        print(f"Vocabulary pool of {size} values per field {source} in {time.perf_counter() - start:.2f}s")
+    return VocabularyPool(Faker(locale), pools)
+
+
+def use_vocabulary_pool(args, verbose=True):
+    global fake
+
+    if args.vocab_pool_size > 0:
+        fake = load_vocabulary_pool(args.vocab_locale, args.vocab_seed, args.vocab_pool_size, args.vocab_cache_dir, verbose)
+
+
+# Consonant-vowel syllables avoid endings RediSearch's stemmer would fold
+# together, so every synthetic term keeps its own posting list.
+ZIPF_SYLLABLES = [consonant + vowel for consonant in "bdfgklmnprtvz" for vowel in "aiou"]
+
+
+class ZipfTextGenerator:
+    def __init__(self, vocab_size, exponent, min_words, max_words, hot_terms=()):
+        self.min_words = min_words
+        self.max_words = max_words
+        self.vocabulary = self._build_vocabulary(vocab_size, hot_terms)
+        weights = [1.0 / (rank + 1) ** exponent for rank in range(len(self.vocabulary))]
+        total = sum(weights)
+        self.probabilities = [weight / total for weight in weights]
+        self.cum_weights = list(itertools.accumulate(self.probabilities))
+        self.vocabulary_array = None
+
+    @staticmethod
+    def _synthetic_term(index):
+        syllables = 2
+        while index >= len(ZIPF_SYLLABLES) ** syllables:
+            index -= len(ZIPF_SYLLABLES) ** syllables
+            syllables += 1
+
+        parts = []
+        for _ in range(syllables):
+            index, remainder = divmod(index, len(ZIPF_SYLLABLES))
+            parts.append(ZIPF_SYLLABLES[remainder])
+        return "".join(parts)
+
+    def _build_vocabulary(self, vocab_size, hot_terms):
+        vocabulary = [term.lower() for term in hot_terms][:vocab_size]
+        seen = set(vocabulary)
+        index = 0
+        while len(vocabulary) < vocab_size:
+            term = self._synthetic_term(index)
+            index += 1
+            if term not in seen:
+                seen.add(term)
+                vocabulary.append(term)
+        return vocabulary
+
+    def words(self, count, rng=random):
+        return rng.choices(self.vocabulary, cum_weights=self.cum_weights, k=count)
+
+    def description(self, rng=random):
+        words = self.words(rng.randint(self.min_words, self.max_words), rng)
+        words[0] = words[0].capitalize()
+        return " ".join(words) + "."
+
+    def title(self, count, rng=random):
+        return " ".join(self.words(count, rng))
+
+    def _build_alias_table(self):
+        # Vose's alias method: each draw is one uniform rank plus one coin
+        # flip against that rank's share, instead of a CDF search.
+        size = len(self.probabilities)
+        shares = [probability * size for probability in self.probabilities]
+        aliases = list(range(size))
+        small = [rank for rank, share in enumerate(shares) if share < 1.0]
+        large = [rank for rank, share in enumerate(shares) if share >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            aliases[less] = more
+            shares[more] -= 1.0 - shares[less]
+            (small if shares[more] < 1.0 else large).append(more)
+        for rank in small + large:
+            shares[rank] = 1.0
+        self.vocabulary_array = numpy.asarray(self.vocabulary, dtype=object)
+        self.alias_shares = numpy.asarray(shares)
+        self.aliases = numpy.asarray(aliases)
+
+    def _block_words(self, rng, counts):
+        # Draws the words of a whole block of texts with a few array operations.
+        if self.vocabulary_array is None:
+            self._build_alias_table()
+        total = sum(counts)
+        ranks = rng.integers(0, len(self.vocabulary), total)
+        ranks = numpy.where(rng.random(total) < self.alias_shares[ranks], ranks, self.aliases[ranks])
+        words = self.vocabulary_array[ranks].tolist()
+        offsets = list(itertools.accumulate(counts, initial=0))
+        return [words[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def description_block(self, rng, count):
+        descriptions = []
+        for words in self._block_words(rng, rng.integers(self.min_words, self.max_words + 1, count).tolist()):
+            words[0] = words[0].capitalize()
+            descriptions.append(" ".join(words) + ".")
+        return descriptions
+
+    def title_block(self, rng, counts):
+        return [" ".join(words) for words in self._block_words(rng, counts)]
+
+    def write_terms_file(self, path, max_books):
+        # Expected posting-list size: documents that contain the term at least
+        # once, at the mean description length.
+        mean_words = (self.min_words + self.max_words) / 2
+        with open(path, "w", encoding="utf-8") as terms_file:
+            terms_file.write("rank,term,probability,expected_docs\n")
+            for rank, (term, probability) in enumerate(zip(self.vocabulary, self.probabilities)):
+                expected_docs = max_books * (1 - (1 - probability) ** mean_words)
+                terms_file.write(f"{rank},{term},{probability:.8f},{expected_docs:.1f}\n")
+
+
+TEXT_GENERATOR = None
+
+
+def make_description(sentences, rng=random, faker=None):
+    if TEXT_GENERATOR is not None:
+        return TEXT_GENERATOR.description(rng)
+    return (faker or fake).paragraph(sentences)
+
+
+def make_title(words, rng=random, faker=None):
+    if TEXT_GENERATOR is not None:
+        return TEXT_GENERATOR.title(words, rng)
+    return " ".join((faker or fake).words(nb=words))
+
+
+def use_text_generator(args, verbose=True):
+    global TEXT_GENERATOR
+
+    if args.text_generator != "zipf":
+        return
+
+    hot_terms = [term for term in args.zipf_hot_terms.split(",") if term]
+    TEXT_GENERATOR = ZipfTextGenerator(
+        args.zipf_vocab_size, args.zipf_exponent,
+        args.description_min_words, args.description_max_words, hot_terms
+    )
+    if verbose and args.zipf_terms_file:
+        TEXT_GENERATOR.write_terms_file(args.zipf_terms_file, args.max_books)
+        print(f"Zipf term table written to {args.zipf_terms_file}")
+
+
+def generate_random_book(book_id, rng=random, faker=None):
+    faker = faker or fake
     return {
-        "author": fake.name(),
+        "author": faker.name(),
         "id": str(book_id),
-        "description": fake.paragraph(random.randint(25, 80)),
-        "editions": random.sample(
-            [
-                "english", "spanish", "french", "german", "italian", "chinese",
-                "japanese", "russian", "arabic", "portuguese", "korean", "dutch",
-                "swedish", "norwegian", "danish", "finnish", "polish", "turkish",
-                "hindi", "urdu", "greek", "hebrew", "thai", "vietnamese",
-                "indonesian", "hungarian", "czech", "slovak", "romanian",
-                "bulgarian", "ukrainian", "serbian", "croatian", "slovenian", "latvian"
-            ],
-            k=random.randint(1, 5)
-        ),
-        "genres": random.sample(
-            [
-                "comics (superheroes)", "fiction", "non-fiction", "science fiction",
-                "fantasy", "mystery", "romance", "history", "horror", "biography",
-                "thriller", "self-help", "poetry", "cookbooks", "memoir",
-                "young adult", "children's literature", "drama", "travel", "science",
-                "art", "philosophy", "psychology", "religion", "true crime",
-                "graphic novel", "adventure", "political", "health", "humor"
-            ],
-            k=random.randint(1, 6)
-        ),
+        "description": make_description(rng.randint(25, 80), rng, faker),
+        "editions": rng.sample(EDITIONS, k=rng.randint(1, 5)),
+        "genres": rng.sample(GENRES, k=rng.randint(1, 6)),
         "inventory": [
             {
-                "status": random.choice(["available", "maintenance", "on_loan", "for_sale"]),
+                "status": rng.choice(INVENTORY_STATUSES),
                 "stock_id": f"{book_id}_{num}"
             }
-            for num in range(random.randint(1, 10))
+            for num in range(rng.randint(1, 10))
         ],
         "metrics": {
-            "rating_votes": random.randint(1, 1000),
-            "score": round(random.uniform(1, 5), 2)
+            "rating_votes": rng.randint(1, 1000),
+            "score": round(rng.uniform(1, 5), 2)
         },
-        "pages": random.randint(50, 1500),
-        "title": " ".join(fake.words(nb=random.randint(1, 5))),
-        "url": fake.url(),
-        "year_published": random.randint(1900, 2023),
-        "format": random.choice(["hardcover", "paperback", "ebook"]),
-        "is_available": random.choice([True, False]),
-        "price": round(random.uniform(5, 100), 2),
-        "isbn": fake.isbn13(),
-        "address": fake.address().replace("\n", ", "),
-        "geo": f"{fake.longitude()},{fake.latitude()}",
-        "weight_grams": random.randint(-100, 2000),
+        "pages": rng.randint(50, 1500),
+        "title": make_title(rng.randint(1, 5), rng, faker),
+        "url": faker.url(),
+        "year_published": rng.randint(1900, 2023),
+        "format": rng.choice(FORMATS),
+        "is_available": rng.choice([True, False]),
+        "price": round(rng.uniform(5, 100), 2),
+        "isbn": faker.isbn13(),
+        "address": faker.address().replace("\n", ", "),
+        "geo": f"{faker.longitude()},{faker.latitude()}",
+        "weight_grams": rng.randint(-100, 2000),
         "dimensions": {
-            "width_cm": round(random.uniform(10, 30), 2),
-            "height_cm": round(random.uniform(20, 40), 2),
-            "depth_cm": round(random.uniform(1, 10), 2)
+            "width_cm": round(rng.uniform(10, 30), 2),
+            "height_cm": round(rng.uniform(20, 40), 2),
+            "depth_cm": round(rng.uniform(1, 10), 2)
         },
-        "edition_number": random.randint(1, 10),
-        "chapter_count": random.randint(5, 50),
-        "review_count": random.randint(0, 5000),
-        "citation_count": random.randint(0, 1000),
-        "timestamp": fake.unix_time(),
-        "publishing_delay": random.randint(-356, 1000),
-        "word_count": random.randint(10000, 150000),
-        "reading_time_minutes": random.randint(30, 1200),
-        "global_sales": random.randint(1000, 1000000),
-        "translations_count": random.randint(1, 50),
-        "publisher": fake.company(),
-        "book_series": fake.word(),
-        "main_character": fake.first_name(),
-        "location": fake.city(),
-        "author_age_at_publication": random.randint(20, 80),
+        "edition_number": rng.randint(1, 10),
+        "chapter_count": rng.randint(5, 50),
+        "review_count": rng.randint(0, 5000),
+        "citation_count": rng.randint(0, 1000),
+        "timestamp": faker.unix_time(end_datetime=TIMESTAMP_END),
+        "publishing_delay": rng.randint(-356, 1000),
+        "word_count": rng.randint(10000, 150000),
+        "reading_time_minutes": rng.randint(30, 1200),
+        "global_sales": rng.randint(1000, 1000000),
+        "translations_count": rng.randint(1, 50),
+        "publisher": faker.company(),
+        "book_series": faker.word(),
+        "main_character": faker.first_name(),
+        "location": faker.city(),
+        "author_age_at_publication": rng.randint(20, 80),
     }
 
 
-def flatten_book_for_hash(book_data):
-    inventory_status = [item["status"] for item in book_data["inventory"]]
-    inventory_stock_id = [item["stock_id"] for item in book_data["inventory"]]
+def generate_book_block(rng, book_ids, faker=None):
+    # Draws a block of books column by column with the same ranges as
+    # generate_random_book. Pooled Faker fields and Zipf text are picked with
+    # index arrays; only text neither covers costs one Faker call per book.
+    faker = faker or fake
+    count = len(book_ids)
 
+    def randint(low, high, size=count):
+        return rng.integers(low, high + 1, size)
+
+    def uniform(low, high, decimals=2):
+        return numpy.round(rng.uniform(low, high, count), decimals).tolist()
+
+    def pick(choices, indexes):
+        return numpy.asarray(choices, dtype=object)[indexes].tolist()
+
+    def text(field):
+        if isinstance(faker, VocabularyPool) and field in faker.pools:
+            return pick(faker.pools[field], randint(0, len(faker.pools[field]) - 1))
+        return [getattr(faker, field)() for _ in range(count)]
+
+    title_words = randint(1, 5).tolist()
+    if TEXT_GENERATOR is not None:
+        descriptions = TEXT_GENERATOR.description_block(rng, count)
+        titles = TEXT_GENERATOR.title_block(rng, title_words)
+    else:
+        descriptions = [faker.paragraph(sentences) for sentences in randint(25, 80).tolist()]
+        titles = [" ".join(faker.words(nb=words)) for words in title_words]
+
+    editions = pick(EDITIONS, rng.random((count, len(EDITIONS))).argsort(axis=1)[:, :5])
+    genres = pick(GENRES, rng.random((count, len(GENRES))).argsort(axis=1)[:, :6])
+    statuses = pick(INVENTORY_STATUSES, randint(0, len(INVENTORY_STATUSES) - 1, (count, 10)))
     return {
-        "author": str(book_data["author"]),
-        "id": str(book_data["id"]),
-        "description": str(book_data["description"]),
-        "editions": "|".join(book_data["editions"]),
-        "genres": "|".join(book_data["genres"]),
-        "status": "|".join(inventory_status),
-        "stock_id": "|".join(inventory_stock_id),
-        "rating_votes": str(book_data["metrics"]["rating_votes"]),
-        "score": str(book_data["metrics"]["score"]),
-        "pages": str(book_data["pages"]),
-        "title": str(book_data["title"]),
-        "url": str(book_data["url"]),
-        "year_published": str(book_data["year_published"]),
-        "format": str(book_data["format"]),
-        "is_available": str(book_data["is_available"]).lower(),
-        "price": str(book_data["price"]),
-        "isbn": str(book_data["isbn"]),
-        "address": str(book_data["address"]),
-        "geo": str(book_data["geo"]),
-        "weight_grams": str(book_data["weight_grams"]),
-        "width_cm": str(book_data["dimensions"]["width_cm"]),
-        "height_cm": str(book_data["dimensions"]["height_cm"]),
-        "depth_cm": str(book_data["dimensions"]["depth_cm"]),
-        "edition_number": str(book_data["edition_number"]),
-        "chapter_count": str(book_data["chapter_count"]),
-        "review_count": str(book_data["review_count"]),
-        "citation_count": str(book_data["citation_count"]),
-        "timestamp": str(book_data["timestamp"]),
-        "publishing_delay": str(book_data["publishing_delay"]),
-        "word_count": str(book_data["word_count"]),
-        "reading_time_minutes": str(book_data["reading_time_minutes"]),
-        "global_sales": str(book_data["global_sales"]),
-        "translations_count": str(book_data["translations_count"]),
-        "publisher": str(book_data["publisher"]),
-        "book_series": str(book_data["book_series"]),
-        "main_character": str(book_data["main_character"]),
-        "location": str(book_data["location"]),
-        "author_age_at_publication": str(book_data["author_age_at_publication"]),
+        "id": numpy.asarray(book_ids).tolist(),
+        "author": text("name"),
+        "description": descriptions,
+        "editions": [row[:size] for row, size in zip(editions, randint(1, 5).tolist())],
+        "genres": [row[:size] for row, size in zip(genres, randint(1, 6).tolist())],
+        "inventory_statuses": [row[:size] for row, size in zip(statuses, randint(1, 10).tolist())],
+        "rating_votes": randint(1, 1000).tolist(),
+        "score": uniform(1, 5),
+        "pages": randint(50, 1500).tolist(),
+        "title": titles,
+        "url": text("url"),
+        "year_published": randint(1900, 2023).tolist(),
+        "format": pick(FORMATS, randint(0, len(FORMATS) - 1)),
+        "is_available": (randint(0, 1) == 1).tolist(),
+        "price": uniform(5, 100),
+        "isbn": text("isbn13"),
+        "address": [address.replace("\n", ", ") for address in text("address")],
+        "geo": [f"{longitude},{latitude}" for longitude, latitude in zip(uniform(-180, 180, 6), uniform(-90, 90, 6))],
+        "weight_grams": randint(-100, 2000).tolist(),
+        "width_cm": uniform(10, 30),
+        "height_cm": uniform(20, 40),
+        "depth_cm": uniform(1, 10),
+        "edition_number": randint(1, 10).tolist(),
+        "chapter_count": randint(5, 50).tolist(),
+        "review_count": randint(0, 5000).tolist(),
+        "citation_count": randint(0, 1000).tolist(),
+        "timestamp": rng.uniform(0, TIMESTAMP_END or time.time(), count).tolist(),
+        "publishing_delay": randint(-356, 1000).tolist(),
+        "word_count": randint(10000, 150000).tolist(),
+        "reading_time_minutes": randint(30, 1200).tolist(),
+        "global_sales": randint(1000, 1000000).tolist(),
+        "translations_count": randint(1, 50).tolist(),
+        "publisher": text("company"),
+        "book_series": text("word"),
+        "main_character": text("first_name"),
+        "location": text("city"),
+        "author_age_at_publication": randint(20, 80).tolist(),
     }
 
 
+def materialize_books(block):
+    # Zips the block's columns, in generate_book_block's order, into book dicts
+    # keyed like generate_random_book.
+    return [
+        {
+            "author": author,
+            "id": str(book_id),
+            "description": description,
+            "editions": editions,
+            "genres": genres,
+            "inventory": [
+                {"status": status, "stock_id": f"{book_id}_{num}"}
+                for num, status in enumerate(statuses)
+            ],
+            "metrics": {"rating_votes": rating_votes, "score": score},
+            "pages": pages,
+            "title": title,
+            "url": url,
+            "year_published": year_published,
+            "format": book_format,
+            "is_available": is_available,
+            "price": price,
+            "isbn": isbn,
+            "address": address,
+            "geo": geo,
+            "weight_grams": weight_grams,
+            "dimensions": {"width_cm": width_cm, "height_cm": height_cm, "depth_cm": depth_cm},
+            "edition_number": edition_number,
+            "chapter_count": chapter_count,
+            "review_count": review_count,
+            "citation_count": citation_count,
+            "timestamp": timestamp,
+            "publishing_delay": publishing_delay,
+            "word_count": word_count,
+            "reading_time_minutes": reading_time_minutes,
+            "global_sales": global_sales,
+            "translations_count": translations_count,
+            "publisher": publisher,
+            "book_series": book_series,
+            "main_character": main_character,
+            "location": location,
+            "author_age_at_publication": author_age_at_publication,
+        }
+        for (
+            book_id, author, description, editions, genres, statuses, rating_votes, score, pages, title, url,
+            year_published, book_format, is_available, price, isbn, address, geo, weight_grams,
+            width_cm, height_cm, depth_cm, edition_number, chapter_count, review_count, citation_count,
+            timestamp, publishing_delay, word_count, reading_time_minutes, global_sales, translations_count,
+            publisher, book_series, main_character, location, author_age_at_publication,
+        ) in zip(*block.values())
+    ]
+
+
+class KeyRanking:
+    # Orders the whole ID space by heat so every sampler shares one hot set.
+    # Ranks are dealt round-robin over the load writers' slices: rank 1 is the
+    # first ID of slice 0, rank 2 the first ID of slice 1 and so on, so the
+    # hot IDs are spread over all writers and each writer still only touches
+    # its own slice.
+    def __init__(self, slices):
+        self.slices = slices
+        self.slice_index = {bounds: index for index, bounds in enumerate(slices)}
+        self.first_id = slices[0][0]
+        self.last_id = slices[-1][1]
+        self.id_count = self.last_id - self.first_id + 1
+        self.min_size = min(last_id - first_id + 1 for first_id, last_id in slices)
+
+    def id_for_rank(self, rank):
+        position, index = divmod(rank - 1, len(self.slices))
+        if position < self.min_size:
+            return self.slices[index][0] + position
+        # Past the shortest slice only the longer ones still have IDs to deal
+        index = rank - 1 - self.min_size * len(self.slices)
+        position = self.min_size
+        while True:
+            longer = [first_id for first_id, last_id in self.slices if last_id - first_id + 1 > position]
+            if index < len(longer):
+                return longer[index] + position
+            index -= len(longer)
+            position += 1
+
+
+class KeySampler:
+    # Picks the book IDs a writer touches within its slice [first_id, last_id].
+    # zipf draws a rank from the continuous inverse CDF of a bounded Zipf law;
+    # hotspot sends hot_share of the writes to the hot_fraction hottest ranks
+    # and spreads the rest uniformly. Without a ranking rank r is simply
+    # first_id + r - 1. With one, a load writer's slice draws only the ranks
+    # the ranking dealt to it, every stride-th from rank_offset, and a sampler
+    # over the whole ID space maps its ranks through the ranking, so updates,
+    # churn and orders hit the same hot IDs as the load.
+    def __init__(self, first_id, last_id, kind="uniform", exponent=1.0, hot_fraction=0.01, hot_share=0.9, ranking=None):
+        self.first_id = first_id
+        self.last_id = last_id
+        self.kind = kind
+        self.exponent = exponent
+        self.hot_share = hot_share
+        self.id_count = last_id - first_id + 1
+        self.next_sequential = first_id
+        self.rng = random
+        self.ranking = None
+        self.stride = 1
+        self.rank_offset = 1
+        total = self.id_count
+        if ranking is not None and (first_id, last_id) in ranking.slice_index:
+            self.stride = len(ranking.slices)
+            self.rank_offset = ranking.slice_index[(first_id, last_id)] + 1
+            total = ranking.id_count
+        elif ranking is not None and (first_id, last_id) == (ranking.first_id, ranking.last_id):
+            self.ranking = ranking
+        hot_ranks = min(total, max(1, int(total * hot_fraction)))
+        if hot_ranks < self.rank_offset:
+            self.hot_count = 0
+        else:
+            self.hot_count = min(self.id_count, (hot_ranks - self.rank_offset) // self.stride + 1)
+
+    def _book_id(self, position):
+        if self.ranking is not None:
+            return self.ranking.id_for_rank(position)
+        return self.first_id + position - 1
+
+    def _zipf_position(self, u):
+        # Global ranks rank_offset + stride * (position - 1) follow the Zipf
+        # law; invert it over [low, high) and map back to a position.
+        low = self.rank_offset
+        high = low + self.stride * self.id_count
+        if self.exponent == 1.0:
+            rank = low * (high / low) ** u
+        else:
+            power = 1.0 - self.exponent
+            rank = (low ** power + u * (high ** power - low ** power)) ** (1 / power)
+        return min(int((rank - low) / self.stride) + 1, self.id_count)
+
+    def next_id(self):
+        if self.kind == "sequential":
+            book_id = self.next_sequential
+            self.next_sequential = book_id + 1 if book_id < self.last_id else self.first_id
+            return book_id
+        if self.kind == "zipf":
+            return self._book_id(self._zipf_position(self.rng.random()))
+        if self.kind == "hotspot":
+            if self.hot_count == self.id_count or (self.hot_count and self.rng.random() < self.hot_share):
+                return self._book_id(self.rng.randint(1, self.hot_count))
+            return self._book_id(self.rng.randint(self.hot_count + 1, self.id_count))
+        return self.rng.randint(self.first_id, self.last_id)
+
+    def next_ids(self, count, rng=None):
+        if rng is None or self.kind == "sequential" or self.ranking is not None:
+            return [self.next_id() for _ in range(count)]
+        if self.kind == "zipf":
+            u = rng.random(count)
+            low = self.rank_offset
+            high = low + self.stride * self.id_count
+            if self.exponent == 1.0:
+                ranks = low * (high / low) ** u
+            else:
+                power = 1.0 - self.exponent
+                ranks = (low ** power + u * (high ** power - low ** power)) ** (1 / power)
+            positions = numpy.minimum(((ranks - low) / self.stride).astype(numpy.int64) + 1, self.id_count)
+            return (self.first_id + positions - 1).tolist()
+        if self.kind == "hotspot" and 0 < self.hot_count < self.id_count:
+            hot = rng.random(count) < self.hot_share
+            hot_ids = rng.integers(self.first_id, self.first_id + self.hot_count, count)
+            cold_ids = rng.integers(self.first_id + self.hot_count, self.last_id + 1, count)
+            return numpy.where(hot, hot_ids, cold_ids).tolist()
+        return rng.integers(self.first_id, self.last_id + 1, count).tolist()
+
+
+WRITTEN_BYTE = re.compile(rb"[^\x00]")
+FREE_BYTE = re.compile(rb"[^\xff]")
+
+
+class IdAllocator:
+    # Tracks the IDs written in a writer's slice with one bit each and hands
+    # out IDs so that overwrite_ratio of them replace a book written earlier
+    # and the rest are new, assuming the slice started empty. Candidates come
+    # from the key sampler; when it keeps drawing the wrong kind of ID, the
+    # bitmap is scanned from a random byte for the nearest one that fits.
+    def __init__(self, sampler, overwrite_ratio, attempts=16):
+        self.sampler = sampler
+        self.first_id = sampler.first_id
+        self.id_count = sampler.id_count
+        self.overwrite_ratio = overwrite_ratio
+        self.attempts = attempts
+        self.bitmap = bytearray((self.id_count + 7) // 8)
+        self.written = 0
+        self.rng = random
+        self.unsettled = None
+
+    def is_written(self, book_id):
+        offset = book_id - self.first_id
+        return self.bitmap[offset >> 3] >> (offset & 7) & 1
+
+    def scan(self, written):
+        pattern = WRITTEN_BYTE if written else FREE_BYTE
+        start = self.rng.randrange(len(self.bitmap))
+        matches = itertools.chain(pattern.finditer(self.bitmap, start), pattern.finditer(self.bitmap, 0, start))
+        for match in matches:
+            byte = match.start()
+            for bit in range(8):
+                offset = byte * 8 + bit
+                if offset < self.id_count and (self.bitmap[byte] >> bit & 1) == written:
+                    return self.first_id + offset
+        return None
+
+    def next_id(self):
+        overwrite = self.written > 0 and (self.written == self.id_count or self.rng.random() < self.overwrite_ratio)
+        for _ in range(self.attempts):
+            book_id = self.sampler.next_id()
+            if self.is_written(book_id) == overwrite:
+                break
+        else:
+            book_id = self.scan(overwrite)
+
+        if not overwrite:
+            offset = book_id - self.first_id
+            self.bitmap[offset >> 3] |= 1 << (offset & 7)
+            self.written += 1
+        self.count("id_overwrite" if overwrite else "id_insert")
+        return book_id
+
+    def next_ids(self, count, rng=None):
+        return [self.next_id() for _ in range(count)]
+
+    def count(self, name):
+        if self.unsettled is None:
+            increment_counter(name)
+        else:
+            self.unsettled.append(name)
+
+    def defer_counts(self):
+        # Writers that learn the outcome of every write hold the insert and
+        # overwrite counts back until settle() reports it, in allocation order.
+        self.unsettled = collections.deque()
+        return self
+
+    def settle(self, succeeded):
+        for success in succeeded:
+            name = self.unsettled.popleft()
+            if success:
+                increment_counter(name)
+
+
+KEY_DISTRIBUTION = {}
+OVERWRITE_RATIO = []
+
+
+def key_sampler(first_id, last_id):
+    sampler = KeySampler(first_id, last_id, **KEY_DISTRIBUTION)
+    if OVERWRITE_RATIO:
+        return IdAllocator(sampler, OVERWRITE_RATIO[0])
+    return sampler
+
+
+def indexed_doc_count(connection_pool):
+    try:
+        return index_stats(redis_client(connection_pool)).get("num_docs")
+    except redis.exceptions.RedisError:
+        return None
+
+
+def print_id_allocation(counters, docs_before, docs_after):
+    inserts = counters["id_insert"]
+    overwrites = counters["id_overwrite"]
+    share = overwrites / (inserts + overwrites) * 100 if inserts + overwrites else 0.0
+    print(f"New books: {inserts}, overwrites: {overwrites} ({share:.1f}% of successful writes)")
+    if docs_before is not None and docs_after is not None:
+        print(f"Index num_docs: {docs_before:.0f} -> {docs_after:.0f} ({docs_after - docs_before:+.0f})")
+
+
+def use_key_distribution(args):
+    del OVERWRITE_RATIO[:]
+    if args.overwrite_ratio is not None:
+        OVERWRITE_RATIO.append(args.overwrite_ratio)
+    KEY_DISTRIBUTION.update(
+        kind=args.key_distribution,
+        exponent=args.key_zipf_exponent,
+        hot_fraction=args.hot_key_fraction,
+        hot_share=args.hot_write_share,
+        ranking=KeyRanking(load_slices(args)) if not args.snapshot else None,
+    )
+
+
+def load_slices(args):
+    # The ID slices of every load writer, across all --processes
+    if args.processes == 1:
+        partitions = plan_partitions(args, args.writers)
+    else:
+        partitions = [
+            partition
+            for parent in plan_partitions(args, args.processes)
+            for partition in plan_partitions(args, args.writers, parent)
+        ]
+    return [(first_id, last_id) for _, first_id, last_id in partitions]
+
+
+def book_faker():
+    faker = Faker(fake.locales)
+    if isinstance(fake, VocabularyPool):
+        return VocabularyPool(faker, fake.pools)
+    return faker
+
+
+def seed_book_block(seed, sampler, faker):
+    rng = random.Random(seed)
+    faker.seed_instance(rng.getrandbits(64))
+    if isinstance(faker, VocabularyPool):
+        faker.rng = rng
+    sampler.rng = rng
+    if isinstance(sampler, IdAllocator):
+        sampler.sampler.rng = rng
+    return rng
+
+
+def iter_seeded_books(max_books, sampler, generator, block_size, seed, start=0):
+    # Every block of block_size books draws from its own RNG and Faker seeded
+    # with (seed, first ID of the writer's slice, block index), so a writer
+    # restarted at a block regenerates exactly the books an uninterrupted run
+    # writes from there on, whatever the other writers are doing.
+    faker = book_faker()
+    for block_start in range(start - start % block_size, max_books, block_size):
+        rng = seed_book_block(f"{seed}:{sampler.first_id}:{block_start // block_size}", sampler, faker)
+        count = min(block_size, max_books - block_start)
+        if generator == "numpy":
+            block_rng = numpy.random.default_rng(rng.getrandbits(64))
+            book_ids = sampler.next_ids(count, block_rng)
+            books = zip(book_ids, materialize_books(generate_book_block(block_rng, book_ids, faker)))
+        else:
+            books = ((book_id, generate_random_book(book_id, rng, faker)) for book_id in (sampler.next_id() for _ in range(count)))
+        for position, book in enumerate(books, block_start):
+            if position >= start:
+                yield book
+
+
+def iter_random_books(max_books, max_random, first_id=1, generator="faker", block_size=1000, sampler=None, seed=None, start=0):
+    if sampler is None:
+        sampler = key_sampler(first_id, max_random)
+    if seed is not None:
+        yield from iter_seeded_books(max_books, sampler, generator, block_size, seed, start)
+        return
+    if generator == "numpy":
+        rng = numpy.random.default_rng(random.getrandbits(64))
+        remaining = max_books
+        while remaining > 0:
+            count = min(block_size, remaining)
+            book_ids = sampler.next_ids(count, rng)
+            yield from zip(book_ids, materialize_books(generate_book_block(rng, book_ids)))
+            remaining -= count
+        return
+
+    for _ in range(max_books):
+        book_id = sampler.next_id()
+        yield book_id, generate_random_book(book_id)
+
+
+HASH_FIELDS = (
+    "author",
+    "id",
+    "description",
+    "editions",
+    "genres",
+    "status",
+    "stock_id",
+    "rating_votes",
+    "score",
+    "pages",
+    "title",
+    "url",
+    "year_published",
+    "format",
+    "is_available",
+    "price",
+    "isbn",
+    "address",
+    "geo",
+    "weight_grams",
+    "width_cm",
+    "height_cm",
+    "depth_cm",
+    "edition_number",
+    "chapter_count",
+    "review_count",
+    "citation_count",
+    "timestamp",
+    "publishing_delay",
+    "word_count",
+    "reading_time_minutes",
+    "global_sales",
+    "translations_count",
+    "publisher",
+    "book_series",
+    "main_character",
+    "location",
+    "author_age_at_publication",
+)
+
+
+def hash_field_values(book_data):
+    inventory_status = [item["status"] for item in book_data["inventory"]]
+    inventory_stock_id = [item["stock_id"] for item in book_data["inventory"]]
+
+    return (
+        str(book_data["author"]),
+        str(book_data["id"]),
+        str(book_data["description"]),
+        "|".join(book_data["editions"]),
+        "|".join(book_data["genres"]),
+        "|".join(inventory_status),
+        "|".join(inventory_stock_id),
+        str(book_data["metrics"]["rating_votes"]),
+        str(book_data["metrics"]["score"]),
+        str(book_data["pages"]),
+        str(book_data["title"]),
+        str(book_data["url"]),
+        str(book_data["year_published"]),
+        str(book_data["format"]),
+        str(book_data["is_available"]).lower(),
+        str(book_data["price"]),
+        str(book_data["isbn"]),
+        str(book_data["address"]),
+        str(book_data["geo"]),
+        str(book_data["weight_grams"]),
+        str(book_data["dimensions"]["width_cm"]),
+        str(book_data["dimensions"]["height_cm"]),
+        str(book_data["dimensions"]["depth_cm"]),
+        str(book_data["edition_number"]),
+        str(book_data["chapter_count"]),
+        str(book_data["review_count"]),
+        str(book_data["citation_count"]),
+        str(book_data["timestamp"]),
+        str(book_data["publishing_delay"]),
+        str(book_data["word_count"]),
+        str(book_data["reading_time_minutes"]),
+        str(book_data["global_sales"]),
+        str(book_data["translations_count"]),
+        str(book_data["publisher"]),
+        str(book_data["book_series"]),
+        str(book_data["main_character"]),
+        str(book_data["location"]),
+        str(book_data["author_age_at_publication"]),
+    )
+
+
+def flatten_book_for_hash(book_data):
+    return dict(zip(HASH_FIELDS, hash_field_values(book_data)))
+
+
 def print_live_status(stop_event):
+    rolling = RollingLatency()
     while not stop_event.is_set():
         counters = get_counters_snapshot()
+        p99_ms = rolling_p99_ms(rolling)
+        rolling_status = f", Rolling p99: {p99_ms:.1f} ms" if p99_ms is not None else ""
         print(
             f"\rCurrent Status, Successful Verification: {counters['data_verification_successful']}, "
             f"Error Verification: {counters['data_verification_error']}, "
             f"Successful Writes: {counters['successful_write']}, "
-            f"Unsuccessful Writes: {counters['unsuccessful_write']}",
+            f"Unsuccessful Writes: {counters['unsuccessful_write']}{rolling_status}   ",
             end="",
             flush=True
         )
@@ -252,7 +1054,7 @@ def print_live_status(stop_event):
 
 def write_data_verification(connection_pool):
     try:
-        r = redis.Redis(connection_pool=connection_pool)
+        r = redis_client(connection_pool)
         book_data = generate_random_book(0)
         book_data["author"] = "Alon Shmuely"
         book_data["title"] = "QA architect"
@@ -262,14 +1064,34 @@ def write_data_verification(connection_pool):
         print(f"Failed to write data verification. Error: {str(e)}")
 
 
+def clear_books(connection_pool, batch_size=1000):
+    # Deletes every book but the verification marker, so the next compared
+    # pass indexes new documents instead of overwriting the previous pass.
+    r = redis_client(connection_pool)
+    marker = make_key(0)
+    pipe = r.pipeline(transaction=False)
+    deleted = 0
+    for key in r.scan_iter(match=f"{REDIS_KEY_BASE}:*", count=batch_size):
+        if key == marker:
+            continue
+        pipe.unlink(key)
+        deleted += 1
+        if len(pipe) >= batch_size:
+            pipe.execute()
+    pipe.execute()
+    return deleted
+
+
 def read_data_verification(connection_pool, stop_event, verify_sleep=0.05):
     try:
-        r = redis.Redis(connection_pool=connection_pool)
+        r = redis_client(connection_pool)
         query = Query("Shmuely").return_fields("title").paging(0, 1)
 
         while not stop_event.is_set():
             try:
+                start = time.perf_counter()
                 docs = r.ft(INDEX_NAME).search(query).docs
+                QUERY_LATENCY.record(time.perf_counter() - start)
                 if docs and getattr(docs[0], "title", None) == "QA architect":
                     increment_counter("data_verification_successful")
                 else:
@@ -284,64 +1106,2355 @@ def read_data_verification(connection_pool, stop_event, verify_sleep=0.05):
         print(f"\nFailed to start data verification. Error: {str(e)}")
 
 
-def generating_books(connection_pool, max_books, max_random):
-    try:
-        r = redis.Redis(connection_pool=connection_pool)
-        for _ in range(1, max_books + 1):
-            book_id = random.randint(1, max_random)
-            book_data = generate_random_book(book_id)
-            r.hset(make_key(book_id), mapping=flatten_book_for_hash(book_data))
-            increment_counter("successful_write")
-    except redis.exceptions.ConnectionError as e:
-        print(f"Failed to generate books. Error: {str(e)}")
-        increment_counter("unsuccessful_write")
+def write_book(r, book_id):
+    r.hset(make_key(book_id), mapping=flatten_book_for_hash(generate_random_book(book_id)))
 
 
-if __name__ == "__main__":
-    arg_parser = argparse.ArgumentParser(description="Running the book store application v2.1")
-    arg_parser.add_argument("--redis", default="redis://localhost:6379", dest="redis_url", help="Redis URL to connect to.")
-    arg_parser.add_argument("--max-connections", default=10, type=int, dest="max_connections", help="Maximum number of Redis connections.")
-    arg_parser.add_argument("--max-books", default=3000, type=int, dest="max_books", help="Maximum number of books")
-    arg_parser.add_argument("--max-random", default=3000, type=int, dest="max_random", help="Maximum random number of books")
-    arg_parser.add_argument("--flush", action="store_true", help="Flush the Redis database on startup")
-    arg_parser.add_argument("--verify-sleep", default=0.05, type=float, dest="verify_sleep", help="Sleep time in seconds between verification queries")
-    args = arg_parser.parse_args()
+VISIBILITY_PROBE = {"lags": {}, "markers": 0, "missed": 0}
 
+
+def visibility_probe(connection_pool, stop_event, rate, poll_interval, timeout):
+    # Writes marker books with unique id tags at a fixed rate and polls
+    # FT.SEARCH until each one is returned. The lag runs from the write's reply
+    # to the first poll that sees the marker, so it is accurate to about one
+    # poll interval. Markers are deleted once the probe stops.
+    r = redis_client(connection_pool)
+    lags = VISIBILITY_PROBE["lags"]
+    pending = {}
+    written = []
+    start = time.perf_counter()
+    next_write = start
     try:
-        print(f"Connecting to Redis at {args.redis_url} with a max of {args.max_connections} connections")
-        redis_pool = create_redis_connection_pool(args.redis_url, args.max_connections)
+        while not stop_event.is_set() or pending:
+            while not stop_event.is_set() and time.perf_counter() >= next_write:
+                marker_id = f"probe{len(written)}"
+                write_book(r, marker_id)
+                pending[make_key(marker_id)] = (marker_id, time.perf_counter())
+                written.append(make_key(marker_id))
+                next_write += 1.0 / rate
 
-        if args.flush:
-            print("Flushing Redis database...")
-            r = redis.Redis(connection_pool=redis_pool)
-            r.flushall()
+            if pending:
+                marker_ids = "|".join(marker_id for marker_id, _ in pending.values())
+                query = Query(f"@id:{{{marker_ids}}}").no_content().paging(0, len(pending))
+                docs = r.ft(INDEX_NAME).search(query).docs
+                seen = time.perf_counter()
+                for doc in docs:
+                    if doc.id in pending:
+                        _, written_at = pending.pop(doc.id)
+                        second = int(written_at - start)
+                        if second not in lags:
+                            lags[second] = LatencyHistogram()
+                        lags[second].record(seen - written_at)
+                for key, (_, written_at) in list(pending.items()):
+                    if seen - written_at > timeout:
+                        del pending[key]
+                        VISIBILITY_PROBE["missed"] += 1
 
-        create_search_index(redis_pool)
-        write_data_verification(redis_pool)
+            time.sleep(poll_interval)
+    except (redis.exceptions.ConnectionError, redis.exceptions.ResponseError) as e:
+        print(f"\nVisibility probe failed. Error: {str(e)}")
+    finally:
+        VISIBILITY_PROBE["markers"] = len(written)
+        try:
+            for index in range(0, len(written), 500):
+                r.delete(*written[index:index + 500])
+        except redis.exceptions.RedisError as e:
+            print(f"\nFailed to delete visibility markers. Error: {str(e)}")
 
-        stop_event = threading.Event()
-        status_stop_event = threading.Event()
 
-        verification_thread = threading.Thread(
-            target=read_data_verification,
-            args=(redis_pool, stop_event, args.verify_sleep)
+def print_visibility_lags(timeout):
+    if not VISIBILITY_PROBE["markers"]:
+        return
+
+    print("\nIndex visibility lag after the write reply (visibility probe)")
+    print_latency_timeline(VISIBILITY_PROBE["lags"], "Markers")
+    print(f"Markers written: {VISIBILITY_PROBE['markers']}, not searchable within {timeout:g}s: {VISIBILITY_PROBE['missed']}")
+
+
+# Hill-climbs the pipeline depth toward the best docs/sec measured over a
+# window of batches; a batch slower than max_latency shrinks the depth and
+# caps it below the size that breached the ceiling.
+class BatchSizeTuner:
+    def __init__(self, initial_size, max_latency, adaptive=True, min_size=1, max_size=10000, window=5, step=1.5, relax_after=3):
+        self.size = max(min_size, min(initial_size, max_size))
+        self.max_latency = max_latency
+        self.adaptive = adaptive
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size_limit = max_size
+        self.relax_after = relax_after
+        self.healthy_windows = 0
+        self.window = window
+        self.step = step
+        self.best_size = self.size
+        self.best_rate = 0.0
+        self.direction = 1
+        self.max_batch_latency = 0.0
+        self._window_docs = 0
+        self._window_elapsed = 0.0
+        self._window_latencies = []
+
+    def _clamp(self, size):
+        return max(self.min_size, min(int(size), self.max_size))
+
+    def _reset_window(self):
+        self._window_docs = 0
+        self._window_elapsed = 0.0
+        self._window_latencies = []
+
+    def _next_size(self):
+        if self.direction > 0:
+            return self._clamp(max(self.size + 1, self.size * self.step))
+        return self._clamp(min(self.size - 1, self.size / self.step))
+
+    def record(self, docs, elapsed):
+        self.max_batch_latency = max(self.max_batch_latency, elapsed)
+        if not self.adaptive:
+            return
+
+        self._window_docs += docs
+        self._window_elapsed += elapsed
+        self._window_latencies.append(elapsed)
+        if len(self._window_latencies) < self.window:
+            return
+
+        # The window is judged by its p80 batch (the second worst of five),
+        # so a lone stall such as a BGSAVE fork or an index GC pass doesn't
+        # count as the batch size being too big.
+        latencies = sorted(self._window_latencies)
+        window_latency = latencies[int((len(latencies) - 1) * 0.8)]
+        rate = self._window_docs / self._window_elapsed if self._window_elapsed > 0 else 0.0
+        self._reset_window()
+
+        if window_latency > self.max_latency and self.size > self.min_size:
+            self.max_size = self._clamp(self.size - 1)
+            self.size = self._clamp(self.size / 2)
+            self.best_size = min(self.best_size, self.max_size)
+            self.best_rate = 0.0
+            self.direction = -1
+            self.healthy_windows = 0
+            return
+
+        if rate >= self.best_rate:
+            self.best_rate = rate
+            self.best_size = self.size
+        else:
+            self.direction = -self.direction
+            self.size = self.best_size
+
+        # A run of healthy windows lifts the cap again and probes upwards, so
+        # a slow spell doesn't pin the size for the rest of the load.
+        self.healthy_windows += 1
+        if self.healthy_windows >= self.relax_after and self.max_size < self.size_limit:
+            self.max_size = min(self.size_limit, max(self.max_size + 1, int(self.max_size * self.step)))
+            self.direction = 1
+            self.healthy_windows = 0
+
+        self.size = self._next_size()
+
+    def report(self):
+        mode = "adaptive" if self.adaptive else "fixed"
+        return (
+            f"{self.best_size} ({mode}, best {self.best_rate:.1f} docs/sec, "
+            f"max batch latency {self.max_batch_latency * 1000:.1f} ms)"
         )
-        write_thread = threading.Thread(
-            target=generating_books,
-            args=(redis_pool, args.max_books, args.max_random)
+
+
+# HDR-style histogram of latencies in microseconds: exact below 128 us, then
+# 64 linear sub-buckets per power of two, so any value is reported within
+# 1.6%. Writer threads record into their own histograms without locking and
+# readers merge them.
+class LatencyHistogram:
+    SUB_BUCKET_BITS = 6
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    BUCKETS = SUB_BUCKETS * 40
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0
+        self.max_us = 0
+
+    @classmethod
+    def bucket_index(cls, value):
+        if value < 2 * cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS - 1
+        return min(shift * cls.SUB_BUCKETS + (value >> shift), cls.BUCKETS - 1)
+
+    @classmethod
+    def bucket_value(cls, index):
+        # Highest value that lands in the bucket
+        if index < 2 * cls.SUB_BUCKETS:
+            return index
+        shift = index // cls.SUB_BUCKETS - 1
+        return ((index - shift * cls.SUB_BUCKETS + 1) << shift) - 1
+
+    def record(self, seconds):
+        value = int(seconds * 1000000)
+        self.counts[self.bucket_index(value)] += 1
+        self.total += 1
+        if value > self.max_us:
+            self.max_us = value
+
+    def merge(self, other):
+        counts = list(other.counts)
+        self.counts = [count + added for count, added in zip(self.counts, counts)]
+        self.total += sum(counts)
+        self.max_us = max(self.max_us, other.max_us)
+
+    def percentile(self, fraction):
+        rank = max(1, math.ceil(self.total * fraction))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bucket_value(index), self.max_us)
+        return self.max_us
+
+
+LATENCY_LOCAL = threading.local()
+
+
+def record_latency(operation, seconds):
+    histograms = getattr(LATENCY_LOCAL, "histograms", None)
+    if histograms is None:
+        histograms = LATENCY_LOCAL.histograms = {}
+
+    histogram = histograms.get(operation)
+    if histogram is None:
+        histogram = histograms[operation] = LatencyHistogram()
+        with COUNTERS_LOCK:
+            LATENCY_HISTOGRAMS.append((operation, histogram))
+    histogram.record(seconds)
+
+
+def merged_latency_histograms():
+    with COUNTERS_LOCK:
+        histograms = list(LATENCY_HISTOGRAMS)
+
+    merged = {}
+    for operation, histogram in histograms:
+        merged.setdefault(operation, LatencyHistogram()).merge(histogram)
+    return merged
+
+
+class RollingLatency:
+    # p99 of the writes recorded since the previous window, at most once per
+    # interval; source returns the histograms to watch instead of all writes
+    def __init__(self, interval=1.0, source=None):
+        self.interval = interval
+        self.source = source
+        self.previous = [0] * LatencyHistogram.BUCKETS
+        self.updated = 0.0
+        self.window = LatencyHistogram()
+        self.p99_us = None
+
+    def update(self):
+        now = time.monotonic()
+        if now - self.updated < self.interval:
+            return self.p99_us
+        self.updated = now
+
+        current = LatencyHistogram()
+        histograms = self.source() if self.source is not None else merged_latency_histograms().values()
+        for histogram in histograms:
+            current.merge(histogram)
+
+        window = LatencyHistogram()
+        window.counts = [count - previous for count, previous in zip(current.counts, self.previous)]
+        window.total = sum(window.counts)
+        window.max_us = current.max_us
+        self.previous = current.counts
+        self.window = window
+        self.p99_us = window.percentile(0.99) if window.total else None
+        return self.p99_us
+
+
+def rolling_p99_ms(rolling):
+    p99_us = rolling.update()
+    with COUNTERS_LOCK:
+        shared = list(SHARED_ROLLING_P99) if SHARED_ROLLING_P99 is not None else []
+
+    values = [value for value in shared if value > 0]
+    if p99_us is not None:
+        values.append(p99_us)
+    return max(values) / 1000 if values else None
+
+
+def print_latency_histograms():
+    histograms = merged_latency_histograms()
+    if not histograms:
+        return
+
+    print(f"\n{'Write latency (ms)':<32}{'Count':>10}{'p50':>9}{'p90':>9}{'p99':>9}{'p99.9':>9}{'Max':>9}")
+    for operation, histogram in histograms.items():
+        percentiles = "".join(
+            f"{histogram.percentile(fraction) / 1000:>9.2f}"
+            for fraction in (0.5, 0.9, 0.99, 0.999)
         )
-        status_thread = threading.Thread(
-            target=print_live_status,
-            args=(status_stop_event,)
+        print(f"{operation:<32}{histogram.total:>10}{percentiles}{histogram.max_us / 1000:>9.2f}")
+
+
+# FT.SEARCH latency of the verification thread, its only writer
+QUERY_LATENCY = LatencyHistogram()
+INDEX_MONITOR = []
+
+
+def server_stat(r, section, field):
+    info = r.info(section)
+    if field in info:
+        return int(info[field])
+    # RedisCluster answers with one dict per node
+    return sum(int(node_info.get(field, 0)) for node_info in info.values() if isinstance(node_info, dict))
+
+
+def info_number(values, name):
+    try:
+        return float(values[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def index_stats(r):
+    try:
+        info = r.ft(INDEX_NAME).info()
+    except redis.exceptions.ResponseError:
+        return {}
+
+    # Nested sections come back as flat [name, value, ...] lists over RESP2
+    gc_stats = info.get("gc_stats", [])
+    if not isinstance(gc_stats, dict):
+        gc_stats = dict(zip(gc_stats[::2], gc_stats[1::2]))
+    gc_bytes = info_number(gc_stats, "bytes_collected")
+    return {
+        "num_docs": info_number(info, "num_docs"),
+        "max_doc_id": info_number(info, "max_doc_id"),
+        "inverted_mb": info_number(info, "inverted_sz_mb"),
+        "gc_cycles": info_number(gc_stats, "total_cycles"),
+        "gc_mb": gc_bytes / (1024 * 1024) if gc_bytes is not None else None,
+    }
+
+
+def index_monitor(connection_pool, stop_event, interval):
+    # Samples write, TTL, churn, update and order throughput, WATCH aborts, the
+    # keys expired by the server, FT.INFO document, inverted index and GC
+    # figures, INFO memory and the verifier's query latency once per interval,
+    # so the run shows how the index keeps up while books expire, are deleted
+    # and rewritten, updated or ordered.
+    r = redis_client(connection_pool)
+    queries = RollingLatency(0, lambda: [QUERY_LATENCY])
+    queries.update()
+    start = previous_time = time.perf_counter()
+    previous = get_counters_snapshot()
+    try:
+        previous_expired = server_stat(r, "stats", "expired_keys")
+    except redis.exceptions.RedisError:
+        previous_expired = None
+
+    while not stop_event.wait(interval):
+        now = time.perf_counter()
+        elapsed = now - previous_time
+        counters = get_counters_snapshot()
+        queries.update()
+        sample = {
+            "second": now - start,
+            "writes": (counters["successful_write"] - previous["successful_write"]) / elapsed,
+            "ttls": (counters["ttl_set"] - previous["ttl_set"]) / elapsed,
+            "churn": (counters["churn_delete"] - previous["churn_delete"]) / elapsed,
+            "updates": (counters["partial_update"] - previous["partial_update"]) / elapsed,
+            "orders": (
+                counters["order_multi_commit"] + counters["order_watch_commit"]
+                - previous["order_multi_commit"] - previous["order_watch_commit"]
+            ) / elapsed,
+            "conflicts": (counters["order_watch_conflict"] - previous["order_watch_conflict"]) / elapsed,
+            "expired": None,
+            "used_mb": None,
+            "query_p50": queries.window.percentile(0.5) if queries.window.total else None,
+            "query_p99": queries.p99_us,
+        }
+        try:
+            expired = server_stat(r, "stats", "expired_keys")
+            if previous_expired is not None:
+                sample["expired"] = (expired - previous_expired) / elapsed
+            previous_expired = expired
+            sample["used_mb"] = server_stat(r, "memory", "used_memory") / (1024 * 1024)
+        except redis.exceptions.RedisError as e:
+            print(f"\nIndex monitor sample failed. Error: {str(e)}")
+        try:
+            sample.update(index_stats(r))
+        except redis.exceptions.RedisError as e:
+            print(f"\nIndex monitor sample failed. Error: {str(e)}")
+        INDEX_MONITOR.append(sample)
+        previous, previous_time = counters, now
+
+
+MONITOR_COLUMNS = [
+    ("second", "Second", 8, 1),
+    ("writes", "Writes/s", 10, 0),
+    ("ttls", "TTLs/s", 8, 0),
+    ("expired", "Expired/s", 11, 0),
+    ("churn", "Churn/s", 9, 0),
+    ("updates", "Updates/s", 11, 0),
+    ("orders", "Orders/s", 10, 0),
+    ("conflicts", "Aborts/s", 10, 0),
+    ("num_docs", "num_docs", 11, 0),
+    ("max_doc_id", "max_doc_id", 12, 0),
+    ("inverted_mb", "Inv MB", 9, 1),
+    ("gc_cycles", "GC runs", 9, 0),
+    ("gc_mb", "GC MB", 8, 1),
+    ("used_mb", "Used MB", 9, 1),
+    ("query_p50", "Query p50", 11, 2),
+    ("query_p99", "Query p99", 11, 2),
+]
+
+
+def print_index_monitor():
+    if not INDEX_MONITOR:
+        return
+
+    print("\nIndex monitor (query latencies in ms)")
+    print("".join(f"{title:>{width}}" for _, title, width, _ in MONITOR_COLUMNS))
+    for sample in INDEX_MONITOR:
+        cells = []
+        for name, _, width, digits in MONITOR_COLUMNS:
+            value = sample.get(name)
+            if value is None:
+                cells.append(f"{'-':>{width}}")
+                continue
+            if name.startswith("query_"):
+                value /= 1000
+            cells.append(f"{value:>{width}.{digits}f}")
+        print("".join(cells))
+    if QUERY_LATENCY.total:
+        print(
+            f"Verification queries: {QUERY_LATENCY.total}, p50 {QUERY_LATENCY.percentile(0.5) / 1000:.2f} ms, "
+            f"p99 {QUERY_LATENCY.percentile(0.99) / 1000:.2f} ms, max {QUERY_LATENCY.max_us / 1000:.2f} ms"
         )
 
-        status_thread.start()
-        verification_thread.start()
-        write_thread.start()
 
-        write_thread.join()
+LOAD_PASSES = []
+
+
+def net_input_bytes(connection_pool):
+    try:
+        return server_stat(redis_client(connection_pool), "stats", "total_net_input_bytes")
+    except redis.exceptions.RedisError:
+        return None
+
+
+def print_load_passes():
+    if len(LOAD_PASSES) < 2 and not any(label.startswith("server-side") for label, _, _, _ in LOAD_PASSES):
+        return
+
+    # Bytes sent are the server's total_net_input_bytes, verifier included
+    print(f"\n{'Load pass':<28}{'Docs':>10}{'Seconds':>10}{'Docs/sec':>12}{'MB sent':>10}{'Bytes/doc':>11}")
+    for label, docs, seconds, sent_bytes in LOAD_PASSES:
+        docs_per_sec = docs / seconds if seconds > 0 else 0.0
+        sent_mb = f"{sent_bytes / (1024 * 1024):>10.2f}" if sent_bytes is not None else f"{'-':>10}"
+        per_doc = f"{sent_bytes / docs:>11.1f}" if sent_bytes is not None and docs else f"{'-':>11}"
+        print(f"{label:<28}{docs:>10}{seconds:>10.2f}{docs_per_sec:>12.1f}{sent_mb}{per_doc}")
+
+
+# Open-loop pacing for --write-rate, shared by the writer threads of a process.
+# Write n is due at start + n / rate whatever happened to the writes before it
+# (a token bucket with no burst), and its latency is measured from that due
+# time, so writes held up behind a stall are charged for the wait instead of
+# quietly being sent later (coordinated omission).
+class WriteSchedule:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.start = None
+        self.issued = 0
+        self.lock = threading.Lock()
+        self.latencies = {}
+
+    def wait(self, count):
+        with self.lock:
+            if self.start is None:
+                self.start = time.perf_counter()
+            first = self.issued
+            self.issued += count
+
+        due_times = [self.start + (first + index) * self.interval for index in range(count)]
+        delay = due_times[-1] - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return due_times
+
+    def record(self, due_times, finished):
+        with self.lock:
+            for due in due_times:
+                second = int(due - self.start)
+                if second not in self.latencies:
+                    self.latencies[second] = LatencyHistogram()
+                self.latencies[second].record(finished - due)
+
+
+def record_write_latencies(label, latencies):
+    with COUNTERS_LOCK:
+        for existing_label, existing in WRITE_LATENCIES:
+            if existing_label == label:
+                for second, histogram in latencies.items():
+                    existing.setdefault(second, LatencyHistogram()).merge(histogram)
+                return
+        WRITE_LATENCIES.append((label, latencies))
+
+
+def print_write_latencies():
+    with COUNTERS_LOCK:
+        write_latencies = list(WRITE_LATENCIES)
+
+    for label, latencies in write_latencies:
+        print(f"\nWrite latency from intended send time ({label})")
+        print_latency_timeline(latencies)
+
+
+def print_latency_timeline(latencies, count_label="Writes"):
+    print(f"{'Second':>8}{count_label:>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'Max ms':>10}")
+    overall = LatencyHistogram()
+    rows = []
+    for second in sorted(latencies):
+        overall.merge(latencies[second])
+        rows.append((str(second), latencies[second]))
+    rows.append(("all", overall))
+    for second, histogram in rows:
+        print(
+            f"{second:>8}{histogram.total:>10}"
+            f"{histogram.percentile(0.5) / 1000:>10.2f}{histogram.percentile(0.9) / 1000:>10.2f}"
+            f"{histogram.percentile(0.99) / 1000:>10.2f}{histogram.max_us / 1000:>10.2f}"
+        )
+
+
+# Expiry churn for --ttl-fraction: a sample of the flushed books gets an
+# absolute expiry --ttl-seconds plus up to --ttl-spread seconds away. With
+# --ttl-wave-period the expiry is rounded up to the next multiple of the period
+# on the wall clock, so all processes send their books out in the same
+# mass-expiry waves. PEXPIREAT only follows the flush (it is a no-op on a key
+# that does not exist yet) and is pipelined by one thread per process; writers
+# block once it falls behind by a few batches.
+class TtlChurn:
+    def __init__(self, connection_pool, fraction, ttl_seconds, spread=0.0, wave_period=0.0, batch_size=500):
+        self.fraction = fraction
+        self.ttl_ms = int(ttl_seconds * 1000)
+        self.spread_ms = int(spread * 1000)
+        self.wave_ms = int(wave_period * 1000)
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=batch_size * 20)
+        self.thread = threading.Thread(target=self.applying, args=(connection_pool,))
+        self.thread.start()
+
+    def expire_at_ms(self):
+        expire_at = int(time.time() * 1000) + self.ttl_ms + random.randint(0, self.spread_ms)
+        if self.wave_ms:
+            expire_at = -(-expire_at // self.wave_ms) * self.wave_ms
+        return expire_at
+
+    def written(self, keys):
+        for key in keys:
+            if random.random() < self.fraction:
+                self.queue.put((bytes(key) if isinstance(key, memoryview) else key, self.expire_at_ms()))
+
+    def applying(self, connection_pool):
+        pipe = redis_client(connection_pool).pipeline(transaction=False)
+        finished = False
+        while not finished:
+            item = self.queue.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            finished = item is None
+            if not batch:
+                continue
+
+            for key, expire_at in batch:
+                pipe.pexpireat(key, expire_at)
+            try:
+                results = pipe.execute(raise_on_error=False)
+                increment_counter("ttl_set", sum(1 for result in results if result is True))
+            except redis.exceptions.RedisError as e:
+                print(f"\nFailed to set {len(batch)} TTLs. Error: {str(e)}")
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def relisting(r, book_id):
+    start = time.perf_counter()
+    write_book(r, book_id)
+    record_latency("churn re-insert", time.perf_counter() - start)
+    increment_counter("churn_relist")
+
+
+def churning(connection_pool, max_random, rate, duration, relist_delay):
+    # Delist/relist cycles for --churn-rate: each cycle deletes a book picked by
+    # --key-distribution over the whole ID space, and every book deleted
+    # --churn-relist-delay seconds earlier is written back as a fresh book, so
+    # the index keeps gaining deleted doc IDs for its GC to reclaim. Cycles are
+    # paced open-loop and books still delisted at the end are relisted.
+    r = redis_client(connection_pool)
+    sampler = KeySampler(1, max_random, **KEY_DISTRIBUTION)
+    schedule = WriteSchedule(rate)
+    delisted = collections.deque()
+    deadline = time.perf_counter() + duration
+    try:
+        while time.perf_counter() < deadline:
+            due_times = schedule.wait(1)
+            book_id = sampler.next_id()
+            start = time.perf_counter()
+            deleted = r.delete(make_key(book_id))
+            record_latency("churn DEL", time.perf_counter() - start)
+            if deleted:
+                increment_counter("churn_delete")
+                delisted.append((start + relist_delay, book_id))
+            while delisted and delisted[0][0] <= time.perf_counter():
+                relisting(r, delisted.popleft()[1])
+            schedule.record(due_times, time.perf_counter())
+
+        while delisted:
+            relisting(r, delisted.popleft()[1])
+    except redis.exceptions.RedisError as e:
+        print(f"\nChurn failed with {len(delisted)} books delisted. Error: {str(e)}")
+    record_write_latencies(f"churn, {rate:g} deletes/sec", schedule.latencies)
+
+
+def update_price(r, key, book_id):
+    r.hset(key, "price", str(round(random.uniform(5, 100), 2)))
+
+
+def update_score(r, key, book_id):
+    r.hset(key, "score", str(round(random.uniform(1, 5), 2)))
+
+
+def update_sales(r, key, book_id):
+    r.hincrby(key, "global_sales", random.randint(1, 100))
+
+
+def update_status(r, key, book_id):
+    statuses = r.hget(key, "status")
+    if not statuses:
+        return
+    count = len(statuses.split("|"))
+    r.hset(key, "status", "|".join([random.choice(INVENTORY_STATUSES)] * count))
+
+
+# --update-mix names mapped to the latency label and the update they send;
+# full rewrites every field as the baseline for the single-field updates.
+UPDATE_OPERATIONS = {
+    "price": ("HSET price", update_price),
+    "score": ("HSET score", update_score),
+    "sales": ("HINCRBY global_sales", update_sales),
+    "status": ("HGET+HSET status", update_status),
+    "full": ("full HSET", lambda r, key, book_id: write_book(r, book_id)),
+}
+DEFAULT_UPDATE_MIX = "price=1,score=1,sales=1,status=1,full=1"
+
+
+def parse_update_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in UPDATE_OPERATIONS:
+            raise ValueError(f"unknown update {name!r}, expected one of {', '.join(UPDATE_OPERATIONS)}")
+        weights[name] = float(weight) if weight else 1.0
+    if not any(weight > 0 for weight in weights.values()) or any(weight < 0 for weight in weights.values()):
+        raise ValueError("--update-mix weights cannot be negative and at least one must be positive")
+    return weights
+
+
+def updating(connection_pool, updates, weights, max_random, schedule=None, check_batch=100):
+    # Updates books that exist: IDs are drawn with --key-distribution over the
+    # whole ID space and filtered by one pipelined EXISTS per check_batch IDs,
+    # outside the timed section, so no update lands on a missing key (or
+    # creates a partial book there).
+    r = redis_client(connection_pool)
+    sampler = KeySampler(1, max_random, **KEY_DISTRIBUTION)
+    names = list(weights)
+    name_weights = [weights[name] for name in names]
+    done = 0
+    empty_batches = 0
+    try:
+        while done < updates:
+            book_ids = sampler.next_ids(check_batch)
+            pipe = r.pipeline(transaction=False)
+            for book_id in book_ids:
+                pipe.exists(make_key(book_id))
+            existing = [book_id for book_id, exists in zip(book_ids, pipe.execute()) if exists]
+            empty_batches = 0 if existing else empty_batches + 1
+            if empty_batches >= 10:
+                print(f"\nStopping updates after {done}: no books found in the ID space")
+                return
+
+            chosen = random.choices(names, weights=name_weights, k=len(existing))
+            for book_id, name in zip(existing[:updates - done], chosen):
+                label, update = UPDATE_OPERATIONS[name]
+                due_times = schedule.wait(1) if schedule is not None else None
+                start = time.perf_counter()
+                update(r, make_key(book_id), book_id)
+                finished = time.perf_counter()
+                record_latency(label, finished - start)
+                increment_counter("partial_update")
+                if schedule is not None:
+                    schedule.record(due_times, finished)
+                done += 1
+    except redis.exceptions.RedisError as e:
+        print(f"\nUpdates failed after {done}. Error: {str(e)}")
+
+
+def run_updaters(connection_pool, args):
+    weights = parse_update_mix(args.update_mix)
+    schedule = WriteSchedule(args.update_rate) if args.update_rate else None
+    update_threads = []
+    for index in range(args.writers):
+        updates = args.update_count // args.writers + (1 if index < args.update_count % args.writers else 0)
+        update_threads.append(threading.Thread(
+            target=updating,
+            args=(connection_pool, updates, weights, args.max_random, schedule)
+        ))
+
+    for update_thread in update_threads:
+        update_thread.start()
+
+    for update_thread in update_threads:
+        update_thread.join()
+
+    if schedule is not None:
+        record_write_latencies(f"updates, {args.update_rate:g} updates/sec", schedule.latencies)
+
+
+def read_inventory(client, key):
+    statuses = client.hget(key, "status")
+    return statuses.split("|") if statuses is not None else None
+
+
+def queue_order(pipe, key, updated, quantity):
+    pipe.hset(key, "status", "|".join(updated))
+    pipe.hincrby(key, "global_sales", quantity)
+    pipe.hincrby(key, "review_count", 1)
+
+
+ORDER_STREAM = "alon:shmuely:orders"
+ORDER_STREAM_MAXLEN = 100000
+
+
+def placing_order(pipe, r, key, book_id, watch, max_retries):
+    for _ in range(max_retries + 1):
+        try:
+            if watch:
+                pipe.watch(key)
+                statuses = read_inventory(pipe, key)
+            else:
+                statuses = read_inventory(r, key)
+            if statuses is None:
+                return "missing"
+
+            updated = list(statuses)
+            if "available" not in updated:
+                if "on_loan" not in updated:
+                    return "out_of_stock"
+                updated = ["available" if status == "on_loan" else status for status in updated]
+            updated[updated.index("available")] = "on_loan"
+
+            quantity = random.randint(1, 3)
+            if watch:
+                pipe.multi()
+            queue_order(pipe, key, updated, quantity)
+            pipe.xadd(
+                ORDER_STREAM,
+                {"book_id": book_id, "quantity": quantity, "mode": "watch" if watch else "multi"},
+                maxlen=ORDER_STREAM_MAXLEN,
+                approximate=True
+            )
+            pipe.execute()
+            return "commit"
+        except redis.exceptions.WatchError:
+            increment_counter("order_watch_conflict")
+        finally:
+            pipe.reset()
+    return "gave_up"
+
+
+def placing_orders(connection_pool, orders, watch, max_retries, max_random):
+    # Each order reads the book's inventory statuses, then one MULTI/EXEC puts
+    # the first available copy on loan (returning the copies on loan first when
+    # none is left, so hot books keep circulating), bumps global_sales and
+    # review_count and appends the order to a capped stream. Books with no copy
+    # available or on loan are out of stock. The WATCH variant aborts when
+    # another client changed the book between the read and EXEC and retries up
+    # to max_retries times; the plain variant commits on a possibly stale read.
+    r = redis_client(connection_pool)
+    pipe = r.pipeline(transaction=True)
+    sampler = KeySampler(1, max_random, **KEY_DISTRIBUTION)
+    label = "order WATCH/MULTI/EXEC" if watch else "order MULTI/EXEC"
+    placed = 0
+    misses = 0
+    try:
+        while placed < orders:
+            book_id = sampler.next_id()
+            start = time.perf_counter()
+            outcome = placing_order(pipe, r, make_key(book_id), book_id, watch, max_retries)
+            if outcome == "missing":
+                misses += 1
+                if misses >= 1000:
+                    print(f"\nStopping orders after {placed}: no books found in the ID space")
+                    return
+                continue
+
+            misses = 0
+            placed += 1
+            if outcome == "out_of_stock":
+                increment_counter("order_out_of_stock")
+                continue
+            if outcome == "gave_up":
+                record_latency("order WATCH gave up", time.perf_counter() - start)
+                increment_counter("order_watch_gave_up")
+            else:
+                record_latency(label, time.perf_counter() - start)
+                increment_counter("order_watch_commit" if watch else "order_multi_commit")
+    except redis.exceptions.RedisError as e:
+        print(f"\nOrders failed after {placed}. Error: {str(e)}")
+
+
+def run_order_writers(connection_pool, args):
+    modes = {"multi": [False], "watch": [True], "both": [False, True]}[args.order_mode]
+    threads = max(args.writers, len(modes))
+    order_threads = []
+    for index in range(threads):
+        orders = args.orders // threads + (1 if index < args.orders % threads else 0)
+        order_threads.append(threading.Thread(
+            target=placing_orders,
+            args=(connection_pool, orders, modes[index % len(modes)], args.order_retries, args.max_random)
+        ))
+
+    start = time.perf_counter()
+    for order_thread in order_threads:
+        order_thread.start()
+
+    for order_thread in order_threads:
+        order_thread.join()
+    return time.perf_counter() - start
+
+
+def print_order_summary(counters, elapsed):
+    for mode in ("multi", "watch"):
+        commits = counters[f"order_{mode}_commit"]
+        if not commits and not (mode == "watch" and counters["order_watch_gave_up"]):
+            continue
+        line = f"Orders ({mode}): {commits} committed, {commits / elapsed:.1f} commits/sec"
+        if mode == "watch":
+            conflicts = counters["order_watch_conflict"]
+            attempts = commits + conflicts
+            abort_rate = conflicts / attempts * 100 if attempts else 0.0
+            line += f", {conflicts} aborted by WATCH ({abort_rate:.1f}% of EXECs), {counters['order_watch_gave_up']} gave up"
+        print(line)
+    print(f"Orders out of stock: {counters['order_out_of_stock']}")
+
+
+# Single-command writers still hand commands over from the producer in groups.
+SINGLE_WRITE_BATCH = 64
+
+
+def flush_pipeline(pipe):
+    results = pipe.execute(raise_on_error=False)
+    errors = sum(1 for result in results if isinstance(result, Exception))
+    increment_counter("successful_write", len(results) - errors)
+    if errors:
+        increment_counter("unsuccessful_write", errors)
+    return results
+
+
+def hset_command(book_id, book_data):
+    command = ["HSET", make_key(book_id)]
+    for field, value in zip(HASH_FIELDS, hash_field_values(book_data)):
+        command.extend((field, value))
+    return command
+
+
+def iter_batches(items, batch_size, max_inflight):
+    # With max_inflight > 0, generation and serialisation run on a producer
+    # thread that blocks once max_inflight batches wait to be flushed, so client
+    # memory is bounded by the batch size rather than by --max-books.
+    if max_inflight <= 0:
+        while True:
+            batch = list(itertools.islice(items, batch_size()))
+            if not batch:
+                return
+            yield batch
+
+    batches = queue.Queue(maxsize=max_inflight)
+    failures = []
+
+    def produce():
+        try:
+            while True:
+                batch = list(itertools.islice(items, batch_size()))
+                if not batch:
+                    break
+                batches.put(batch)
+        except Exception as e:
+            failures.append(e)
+        finally:
+            batches.put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+        yield batch
+
+    if failures:
+        raise failures[0]
+
+
+def writing_commands(r, commands, tuner=None, max_inflight=2, schedule=None, ttl=None, progress=None, allocator=None):
+    if tuner is None:
+        for batch in iter_batches(commands, lambda: SINGLE_WRITE_BATCH, max_inflight):
+            for command in batch:
+                due_times = schedule.wait(1) if schedule is not None else None
+                start = time.perf_counter()
+                r.execute_command(*command)
+                record_latency("HSET", time.perf_counter() - start)
+                increment_counter("successful_write")
+                if allocator is not None:
+                    allocator.settle((True,))
+                if schedule is not None:
+                    schedule.record(due_times, time.perf_counter())
+                if ttl is not None:
+                    ttl.written((command[1],))
+                if progress is not None:
+                    progress((command[1],))
+        return
+
+    pipe = r.pipeline(transaction=False)
+    for batch in iter_batches(commands, lambda: tuner.size, max_inflight):
+        for command in batch:
+            pipe.execute_command(*command)
+
+        due_times = schedule.wait(len(batch)) if schedule is not None else None
+        start = time.perf_counter()
+        results = flush_pipeline(pipe)
+        finished = time.perf_counter()
+        if allocator is not None:
+            allocator.settle(not isinstance(result, Exception) for result in results)
+        tuner.record(len(batch), finished - start)
+        record_latency("pipeline flush", finished - start)
+        if schedule is not None:
+            schedule.record(due_times, finished)
+        if ttl is not None:
+            ttl.written(command[1] for command in batch)
+        if progress is not None:
+            progress([command[1] for command in batch])
+
+
+def generating_books(connection_pool, max_books, max_random, tuner=None, first_id=1, generator="faker", block_size=1000, max_inflight=2, schedule=None, ttl=None, sampler=None, progress=None, seed=None, start=0):
+    try:
+        r = redis_client(connection_pool)
+        if sampler is None:
+            sampler = key_sampler(first_id, max_random)
+        allocator = sampler.defer_counts() if isinstance(sampler, IdAllocator) else None
+        books = iter_random_books(max_books, max_random, first_id, generator, block_size, sampler, seed, start)
+        commands = (hset_command(book_id, book_data) for book_id, book_data in books)
+        writing_commands(r, commands, tuner, max_inflight, schedule, ttl, progress, allocator)
+    except redis.exceptions.ConnectionError as e:
+        print(f"Failed to generate books. Error: {str(e)}")
+        increment_counter("unsuccessful_write")
+
+
+# Snapshot layout: a fixed header followed by length-prefixed records, each
+# one a length-prefixed list of the command arguments that write a book.
+SNAPSHOT_HEADER = struct.Struct("<8sBcQ")
+SNAPSHOT_LENGTH = struct.Struct("<I")
+SNAPSHOT_MAGIC = b"BOOKSNAP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_KIND = b"H"
+
+
+def encode_snapshot_record(command):
+    parts = [SNAPSHOT_LENGTH.pack(len(command))]
+    for arg in command:
+        encoded = arg.encode()
+        parts.append(SNAPSHOT_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+
+    body = b"".join(parts)
+    return SNAPSHOT_LENGTH.pack(len(body)) + body
+
+
+def write_snapshot(path, max_books, max_random, generator, block_size):
+    start = time.perf_counter()
+    records = 0
+    with open(path, "wb") as snapshot_file:
+        snapshot_file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_KIND, 0))
+        for book_id, book_data in iter_random_books(max_books, max_random, 1, generator, block_size):
+            snapshot_file.write(encode_snapshot_record(hset_command(book_id, book_data)))
+            records += 1
+            if records % 10000 == 0:
+                print(f"\rGenerated books: {records}", end="", flush=True)
+
+        size = snapshot_file.tell()
+        snapshot_file.seek(0)
+        snapshot_file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_KIND, records))
+
+    elapsed = time.perf_counter() - start
+    print(f"\rWrote {records} books ({size / (1024 * 1024):.1f} MB) to {path} in {elapsed:.2f}s")
+
+
+def open_snapshot(path):
+    with open(path, "rb") as snapshot_file:
+        snapshot = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, kind, records = SNAPSHOT_HEADER.unpack_from(snapshot, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f"{path} is not a book snapshot file")
+    if kind != SNAPSHOT_KIND:
+        raise ValueError(f"{path} holds {kind.decode()} records, this populator loads {SNAPSHOT_KIND.decode()} records")
+    return snapshot, records
+
+
+def iter_snapshot_commands(snapshot, start, end):
+    # Arguments are yielded as memoryview slices of the mapping, so records go
+    # to the pipeline without being copied or decoded; only the command name
+    # is decoded because redis-py looks it up in its response callbacks.
+    view = memoryview(snapshot)
+    offset = SNAPSHOT_HEADER.size
+    for index in range(end):
+        (record_length,) = SNAPSHOT_LENGTH.unpack_from(view, offset)
+        if index >= start:
+            position = offset + SNAPSHOT_LENGTH.size
+            (argc,) = SNAPSHOT_LENGTH.unpack_from(view, position)
+            position += SNAPSHOT_LENGTH.size
+            command = []
+            for _ in range(argc):
+                (length,) = SNAPSHOT_LENGTH.unpack_from(view, position)
+                position += SNAPSHOT_LENGTH.size
+                command.append(view[position:position + length])
+                position += length
+            command[0] = bytes(command[0]).decode()
+            yield command
+        offset += SNAPSHOT_LENGTH.size + record_length
+
+
+def loading_snapshot(connection_pool, snapshot_path, start, end, tuner=None, max_inflight=2, schedule=None, ttl=None, progress=None):
+    try:
+        r = redis_client(connection_pool)
+        snapshot, _ = open_snapshot(snapshot_path)
+        commands = iter_snapshot_commands(snapshot, start, end)
+        writing_commands(r, commands, tuner, max_inflight, schedule, ttl, progress)
+    except redis.exceptions.ConnectionError as e:
+        print(f"Failed to load snapshot. Error: {str(e)}")
+        increment_counter("unsuccessful_write")
+
+
+def partition_commands(partition, args):
+    if args.snapshot:
+        start, end = partition
+        snapshot, _ = open_snapshot(args.snapshot)
+        return iter_snapshot_commands(snapshot, start, end)
+
+    books, first_id, last_id = partition
+    books = iter_random_books(books, last_id, first_id, args.generator, args.block_size)
+    return (hset_command(book_id, book_data) for book_id, book_data in books)
+
+
+# Function library for --server-side: the server builds every book from a
+# PRNG seeded with (seed, id) and writes it itself, so the client only sends
+# FCALL batches of IDs instead of whole books. Text is made of syllable words
+# rather than Faker output. Keys are built from the IDs and not declared,
+# which standalone Redis allows and cluster mode does not.
+BOOKGEN_FUNCTION = "generate_hash_books"
+BOOKGEN_LIBRARY = """#!lua name=bookgen_hash
+
+local EDITIONS = cjson.decode([==[@EDITIONS@]==])
+local GENRES = cjson.decode([==[@GENRES@]==])
+local STATUSES = cjson.decode([==[@STATUSES@]==])
+local FORMATS = cjson.decode([==[@FORMATS@]==])
+local SYLLABLES = cjson.decode([==[@SYLLABLES@]==])
+local KEY_PREFIX = [==[@KEY_PREFIX@]==]
+
+-- Park-Miller generator seeded from the SHA1 of seed and id, so a book only
+-- depends on (seed, id) and not on how the ids were batched
+local function new_rng(seed, id)
+    local state = tonumber(string.sub(redis.sha1hex(seed .. ':' .. id), 1, 12), 16) % 2147483646 + 1
+    return function(low, high)
+        state = (state * 16807) % 2147483647
+        return low + state % (high - low + 1)
+    end
+end
+
+local function pick(rand, list)
+    return list[rand(1, #list)]
+end
+
+local function sample(rand, list, count)
+    local pool = {}
+    for i = 1, #list do
+        pool[i] = list[i]
+    end
+    local chosen = {}
+    for i = 1, count do
+        local j = rand(i, #pool)
+        pool[i], pool[j] = pool[j], pool[i]
+        chosen[i] = pool[i]
+    end
+    return chosen
+end
+
+local function word(rand)
+    local parts = {}
+    for i = 1, rand(2, 4) do
+        parts[i] = pick(rand, SYLLABLES)
+    end
+    return table.concat(parts)
+end
+
+local function words(rand, count)
+    local parts = {}
+    for i = 1, count do
+        parts[i] = word(rand)
+    end
+    return table.concat(parts, ' ')
+end
+
+local function capitalized(rand)
+    return (string.gsub(word(rand), '^%l', string.upper))
+end
+
+local function make_book(rand, id)
+    local book = {}
+    book.author = capitalized(rand) .. ' ' .. capitalized(rand)
+    book.id = id
+    -- Faker paragraphs average six words per sentence
+    book.description = words(rand, rand(25, 80) * 6)
+    book.editions = sample(rand, EDITIONS, rand(1, 5))
+    book.genres = sample(rand, GENRES, rand(1, 6))
+    book.inventory = {}
+    for num = 0, rand(1, 10) - 1 do
+        book.inventory[num + 1] = {status = pick(rand, STATUSES), stock_id = id .. '_' .. num}
+    end
+    book.metrics = {rating_votes = rand(1, 1000), score = rand(100, 500) / 100}
+    book.pages = rand(50, 1500)
+    book.title = words(rand, rand(1, 5))
+    book.url = 'https://www.' .. word(rand) .. '.com/'
+    book.year_published = rand(1900, 2023)
+    book.format = pick(rand, FORMATS)
+    book.is_available = rand(0, 1) == 1
+    book.price = rand(500, 10000) / 100
+    book.isbn = '978-' .. rand(0, 9) .. '-' .. rand(10000, 99999) .. '-' .. rand(100, 999) .. '-' .. rand(0, 9)
+    book.address = rand(1, 99999) .. ' ' .. capitalized(rand) .. ' Street, ' .. capitalized(rand) .. ', ' .. rand(10000, 99999)
+    book.geo = string.format('%.6f,%.6f', rand(-180000000, 180000000) / 1000000, rand(-90000000, 90000000) / 1000000)
+    book.weight_grams = rand(-100, 2000)
+    book.dimensions = {width_cm = rand(1000, 3000) / 100, height_cm = rand(2000, 4000) / 100, depth_cm = rand(100, 1000) / 100}
+    book.edition_number = rand(1, 10)
+    book.chapter_count = rand(5, 50)
+    book.review_count = rand(0, 5000)
+    book.citation_count = rand(0, 1000)
+    book.timestamp = rand(0, 1700000000)
+    book.publishing_delay = rand(-356, 1000)
+    book.word_count = rand(10000, 150000)
+    book.reading_time_minutes = rand(30, 1200)
+    book.global_sales = rand(1000, 1000000)
+    book.translations_count = rand(1, 50)
+    book.publisher = capitalized(rand) .. ' ' .. capitalized(rand) .. ' Inc'
+    book.book_series = word(rand)
+    book.main_character = capitalized(rand)
+    book.location = capitalized(rand)
+    book.author_age_at_publication = rand(20, 80)
+    return book
+end
+
+local function write_book(key, book)
+    local statuses, stock_ids = {}, {}
+    for i, item in ipairs(book.inventory) do
+        statuses[i] = item.status
+        stock_ids[i] = item.stock_id
+    end
+    local fields = {
+        'author', book.author, 'id', book.id, 'description', book.description,
+        'editions', table.concat(book.editions, '|'), 'genres', table.concat(book.genres, '|'),
+        'status', table.concat(statuses, '|'), 'stock_id', table.concat(stock_ids, '|'),
+        'rating_votes', book.metrics.rating_votes, 'score', book.metrics.score,
+        'pages', book.pages, 'title', book.title, 'url', book.url, 'year_published', book.year_published,
+        'format', book.format, 'is_available', book.is_available, 'price', book.price,
+        'isbn', book.isbn, 'address', book.address, 'geo', book.geo, 'weight_grams', book.weight_grams,
+        'width_cm', book.dimensions.width_cm, 'height_cm', book.dimensions.height_cm,
+        'depth_cm', book.dimensions.depth_cm, 'edition_number', book.edition_number,
+        'chapter_count', book.chapter_count, 'review_count', book.review_count,
+        'citation_count', book.citation_count, 'timestamp', book.timestamp,
+        'publishing_delay', book.publishing_delay, 'word_count', book.word_count,
+        'reading_time_minutes', book.reading_time_minutes, 'global_sales', book.global_sales,
+        'translations_count', book.translations_count, 'publisher', book.publisher,
+        'book_series', book.book_series, 'main_character', book.main_character,
+        'location', book.location, 'author_age_at_publication', book.author_age_at_publication,
+    }
+    -- tostring keeps prices like 12.5 short; redis.call would send %.17g
+    for i = 2, #fields, 2 do
+        fields[i] = tostring(fields[i])
+    end
+    redis.call('HSET', key, unpack(fields))
+end
+
+-- FCALL generate_hash_books 0 seed id [id ...]
+local function generate_books(keys, args)
+    local seed = args[1]
+    for i = 2, #args do
+        write_book(KEY_PREFIX .. args[i], make_book(new_rng(seed, args[i]), args[i]))
+    end
+    return #args - 1
+end
+
+redis.register_function('generate_hash_books', generate_books)
+"""
+
+
+def bookgen_library():
+    source = BOOKGEN_LIBRARY
+    lists = (
+        ("EDITIONS", EDITIONS), ("GENRES", GENRES), ("STATUSES", INVENTORY_STATUSES),
+        ("FORMATS", FORMATS), ("SYLLABLES", ZIPF_SYLLABLES),
+    )
+    for placeholder, values in lists:
+        source = source.replace(f"@{placeholder}@", json.dumps(values))
+    return source.replace("@KEY_PREFIX@", f"{REDIS_KEY_BASE}:")
+
+
+def iter_book_ids(max_books, sampler):
+    for _ in range(max_books):
+        yield sampler.next_id()
+
+
+def server_side_generating(connection_pool, max_books, max_random, first_id, seed, books_per_call):
+    try:
+        r = redis_client(connection_pool)
+        sampler = key_sampler(first_id, max_random)
+        allocator = sampler.defer_counts() if isinstance(sampler, IdAllocator) else None
+        book_ids = iter_book_ids(max_books, sampler)
+        while True:
+            batch = list(itertools.islice(book_ids, books_per_call))
+            if not batch:
+                break
+            start = time.perf_counter()
+            written = r.fcall(BOOKGEN_FUNCTION, 0, seed, *batch)
+            record_latency(f"FCALL x{books_per_call}", time.perf_counter() - start)
+            increment_counter("successful_write", written)
+            if allocator is not None:
+                allocator.settle([True] * len(batch))
+    except (redis.exceptions.ConnectionError, redis.exceptions.ResponseError) as e:
+        print(f"\nFailed to generate books server-side. Error: {str(e)}")
+        increment_counter("unsuccessful_write")
+
+
+def run_server_side_writers(connection_pool, partitions, args):
+    try:
+        redis_client(connection_pool).function_load(bookgen_library(), replace=True)
+    except redis.exceptions.ResponseError as e:
+        print(f"\nFailed to load the book generation functions. Error: {str(e)}")
+        return
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 31)
+    write_threads = [
+        threading.Thread(
+            target=server_side_generating,
+            args=(connection_pool, books, last_id, first_id, seed, args.server_side_batch)
+        )
+        for books, first_id, last_id in partitions
+    ]
+    for write_thread in write_threads:
+        write_thread.start()
+
+    for write_thread in write_threads:
+        write_thread.join()
+
+
+async def async_connection_writer(connection, batches, depth):
+    # Up to depth requests (one HSET, or one pipeline of --batch-size HSETs)
+    # are written ahead of their replies on this one connection. Replies come
+    # back in order, so the reader only needs the size and send time of each.
+    # Every writer pulls from the shared iterator; generation runs on the
+    # event loop between awaits, so no lock is needed around it.
+    window = asyncio.Semaphore(depth)
+    in_flight = asyncio.Queue()
+
+    async def send():
+        for batch in batches:
+            await window.acquire()
+            start = time.perf_counter()
+            await connection.send_packed_command(connection.pack_commands(batch), check_health=False)
+            in_flight.put_nowait((len(batch), start))
+        in_flight.put_nowait(None)
+
+    async def receive():
+        while True:
+            request = await in_flight.get()
+            if request is None:
+                return
+            size, start = request
+            errors = 0
+            for _ in range(size):
+                try:
+                    await connection.read_response()
+                except redis.exceptions.ResponseError as e:
+                    if size == 1:
+                        print(f"\nAsync write failed. Error: {str(e)}")
+                    errors += 1
+            record_latency("async HSET" if size == 1 else "async pipeline flush", time.perf_counter() - start)
+            increment_counter("successful_write", size - errors)
+            if errors:
+                increment_counter("unsuccessful_write", errors)
+            window.release()
+
+    await asyncio.gather(send(), receive())
+
+
+async def async_writing_commands(redis_url, commands, connections, depth, batch_size):
+    connection_pool = redis.asyncio.ConnectionPool.from_url(redis_url, max_connections=connections)
+    batches = iter_batches(commands, lambda: batch_size, 0)
+    try:
+        writers = [await connection_pool.get_connection() for _ in range(connections)]
+        await asyncio.gather(*(async_connection_writer(connection, batches, depth) for connection in writers))
+    finally:
+        await connection_pool.disconnect()
+
+
+def run_async_writers(partitions, args):
+    commands = itertools.chain.from_iterable(partition_commands(partition, args) for partition in partitions)
+    try:
+        asyncio.run(async_writing_commands(args.redis_url, commands, args.async_connections, args.async_concurrency, args.batch_size))
+    except redis.exceptions.ConnectionError as e:
+        print(f"Failed to write books asynchronously. Error: {str(e)}")
+        increment_counter("unsuccessful_write")
+    return [("async", f"{args.batch_size} (fixed, {args.async_concurrency} in flight on each of {args.async_connections} connections)")]
+
+
+# Raw RESP engine: commands are appended to one reused bytearray and written
+# with sendall, while a reader thread only counts replies instead of parsing
+# them into Python objects.
+RESP_SENTINEL = b"*1\r\n$4\r\nPING\r\n"
+
+
+def append_resp_command(buffer, command):
+    buffer += b"*%d\r\n" % len(command)
+    for arg in command:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        buffer += b"$%d\r\n" % len(arg)
+        buffer += arg
+        buffer += b"\r\n"
+
+
+# Generated books skip the per-command list: the HSET header and every field
+# name are encoded once, and only the key and values are encoded per book.
+HSET_HEADER = b"*%d\r\n$4\r\nHSET\r\n" % (2 + 2 * len(HASH_FIELDS))
+HASH_FIELD_HEADERS = tuple(b"\r\n$%d\r\n%s\r\n$" % (len(field), field.encode()) for field in HASH_FIELDS)
+
+
+def append_resp_book(buffer, book):
+    book_id, book_data = book
+    key = make_key(book_id).encode()
+    buffer += HSET_HEADER
+    buffer += b"$%d\r\n" % len(key)
+    buffer += key
+    for header, value in zip(HASH_FIELD_HEADERS, hash_field_values(book_data)):
+        value = value.encode()
+        buffer += header
+        buffer += b"%d\r\n" % len(value)
+        buffer += value
+    buffer += b"\r\n"
+
+
+class RespReplyCounter:
+    def __init__(self):
+        self.pending = b""
+        self.first_error = None
+
+    def feed(self, data):
+        data = self.pending + data if self.pending else data
+        position = 0
+        replies = 0
+        errors = 0
+        while True:
+            end = data.find(b"\r\n", position)
+            if end < 0:
+                break
+
+            kind = data[position:position + 1]
+            if kind == b"$":
+                length = int(data[position + 1:end])
+                if length >= 0:
+                    if len(data) < end + length + 4:
+                        break
+                    end += length + 2
+            elif kind == b"-":
+                errors += 1
+                if self.first_error is None:
+                    self.first_error = data[position + 1:end].decode(errors="replace")
+
+            replies += 1
+            position = end + 2
+
+        self.pending = data[position:]
+        return replies, errors
+
+
+def open_resp_socket(redis_url):
+    options = parse_url(redis_url)
+    sock = socket.create_connection((options.get("host", "localhost"), options.get("port", 6379)))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    setup = bytearray()
+    if options.get("password"):
+        username = options.get("username")
+        append_resp_command(setup, ["AUTH", username, options["password"]] if username else ["AUTH", options["password"]])
+    if options.get("db"):
+        append_resp_command(setup, ["SELECT", str(options["db"])])
+    if setup:
+        expected = (1 if options.get("password") else 0) + (1 if options.get("db") else 0)
+        sock.sendall(setup)
+        counter = RespReplyCounter()
+        replies = 0
+        while replies < expected:
+            data = sock.recv(65536)
+            if not data:
+                raise redis.exceptions.ConnectionError("Connection closed during setup")
+            received, errors = counter.feed(data)
+            replies += received
+            if errors:
+                raise redis.exceptions.ConnectionError(f"Setup failed: {counter.first_error}")
+    return sock
+
+
+def count_resp_replies(sock, progress):
+    # Stops at the reply to RESP_SENTINEL, which is sent after the last command
+    # and only once progress["expected"] has been set.
+    counter = RespReplyCounter()
+    replies = 0
+    while True:
+        data = sock.recv(1 << 20)
+        if not data:
+            progress["error"] = "connection closed before all replies were read"
+            return
+
+        received, errors = counter.feed(data)
+        replies += received
+        finished = progress["expected"] is not None and replies >= progress["expected"]
+        if finished:
+            received -= 1
+        increment_counter("successful_write", received - errors)
+        if errors:
+            increment_counter("unsuccessful_write", errors)
+            progress["first_error"] = progress["first_error"] or counter.first_error
+        if finished:
+            return
+
+
+def raw_resp_writing(redis_url, records, append, buffer_bytes):
+    try:
+        sock = open_resp_socket(redis_url)
+    except (OSError, redis.exceptions.ConnectionError) as e:
+        print(f"Failed to open a raw RESP connection. Error: {str(e)}")
+        increment_counter("unsuccessful_write")
+        return
+
+    progress = {"expected": None, "error": None, "first_error": None}
+    reader = threading.Thread(target=count_resp_replies, args=(sock, progress))
+    reader.start()
+    sent_all = False
+    try:
+        buffer = bytearray()
+        sent = 0
+        for record in records:
+            append(buffer, record)
+            sent += 1
+            if len(buffer) >= buffer_bytes:
+                sock.sendall(buffer)
+                buffer.clear()
+
+        progress["expected"] = sent + 1
+        buffer += RESP_SENTINEL
+        sock.sendall(buffer)
+        sent_all = True
+    except OSError as e:
+        print(f"Failed to write raw RESP commands. Error: {str(e)}")
+        increment_counter("unsuccessful_write")
+    finally:
+        # Without the sentinel the reader waits for replies that never come,
+        # whatever stopped the writer (socket, snapshot or generator error).
+        if not sent_all:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        reader.join()
+        sock.close()
+
+    if progress["error"]:
+        print(f"\nRaw RESP writer stopped early: {progress['error']}")
+    if progress["first_error"]:
+        print(f"\nRaw RESP writes failed. First error: {progress['first_error']}")
+
+
+def partition_resp_records(partition, args):
+    if args.snapshot:
+        return partition_commands(partition, args), append_resp_command
+
+    books, first_id, last_id = partition
+    return iter_random_books(books, last_id, first_id, args.generator, args.block_size), append_resp_book
+
+
+def run_raw_resp_writers(partitions, args):
+    buffer_bytes = args.raw_buffer_kb * 1024
+    write_threads = [
+        threading.Thread(
+            target=raw_resp_writing,
+            args=(args.redis_url, *partition_resp_records(partition, args), buffer_bytes)
+        )
+        for partition in partitions
+    ]
+
+    for write_thread in write_threads:
+        write_thread.start()
+
+    for write_thread in write_threads:
+        write_thread.join()
+
+    return [("raw RESP", f"{args.raw_buffer_kb} KB send buffer")]
+
+
+# In --cluster mode every writer buckets its commands by the primary that owns
+# each key's hash slot. Each primary gets its own flusher thread and a bounded
+# queue of pipelines, so shards are written in parallel and a slow shard only
+# holds back its own queue rather than every batch. Unless a batch size is
+# given, cluster writers pipeline CLUSTER_BATCH_SIZE commands per node, since
+# one command per pipeline leaves every node waiting on round trips.
+CLUSTER_BATCH_SIZE = 100
+class ClusterWriter:
+    def __init__(self, cluster, batch_size, max_queued=2):
+        self.cluster = cluster
+        self.batch_size = max(1, batch_size)
+        self.max_queued = max(1, max_queued)
+        self.nodes = {}
+        self.buffers = {}
+        self.queues = {}
+        self.flushers = []
+        self.failed = set()
+
+    def write(self, command):
+        key = command[1]
+        node = self.cluster.get_node_from_key(key.tobytes() if isinstance(key, memoryview) else key)
+        self.nodes[node.name] = node
+        buffer = self.buffers.setdefault(node.name, [])
+        buffer.append(command)
+        if len(buffer) >= self.batch_size:
+            self._submit(node, buffer)
+            self.buffers[node.name] = []
+
+    def _submit(self, node, commands):
+        if node.name in self.failed:
+            increment_counter("unsuccessful_write", len(commands))
+            return
+        work = self.queues.get(node.name)
+        if work is None:
+            work = self.queues[node.name] = queue.Queue(maxsize=self.max_queued)
+            flusher = threading.Thread(target=self._flush_node, args=(node, work))
+            flusher.start()
+            self.flushers.append(flusher)
+        work.put(commands)
+
+    def _flush_node(self, node, work):
+        pipe = None
+        while True:
+            commands = work.get()
+            if commands is None:
+                return
+            if node.name in self.failed:
+                increment_counter("unsuccessful_write", len(commands))
+                continue
+
+            # A failure outside a pipeline reply stops this node's flushes;
+            # the flusher keeps draining so the writer never blocks on put().
+            try:
+                if pipe is None:
+                    pipe = self.cluster.get_redis_connection(node).pipeline(transaction=False)
+                self._flush(node, pipe, commands)
+            except Exception as e:
+                print(f"\nFlusher for {node.name} stopped. Error: {str(e)}")
+                self.failed.add(node.name)
+                increment_counter("unsuccessful_write", len(commands))
+
+    def _flush(self, node, pipe, commands):
+        for command in commands:
+            pipe.execute_command(*command)
+        start = time.perf_counter()
+        try:
+            results = pipe.execute(raise_on_error=False)
+        except redis.exceptions.RedisError as e:
+            print(f"\nFlush to {node.name} failed. Error: {str(e)}")
+            increment_counter("unsuccessful_write", len(commands))
+            return
+        record_latency("cluster pipeline flush", time.perf_counter() - start)
+
+        redirected = [
+            command for command, result in zip(commands, results)
+            if isinstance(result, (redis.exceptions.MovedError, redis.exceptions.AskError))
+        ]
+        errors = sum(1 for result in results if isinstance(result, Exception)) - len(redirected)
+        increment_counter("successful_write", len(results) - errors - len(redirected))
+        if errors:
+            increment_counter("unsuccessful_write", errors)
+
+        # Slots moved since the writer bucketed them: RedisCluster follows
+        # the redirect and refreshes its slot map for the next buckets.
+        for command in redirected:
+            try:
+                self.cluster.execute_command(*command)
+                increment_counter("successful_write")
+            except redis.exceptions.RedisError:
+                increment_counter("unsuccessful_write")
+
+    def close(self):
+        for name, commands in self.buffers.items():
+            if commands:
+                self._submit(self.nodes[name], commands)
+        self.buffers = {}
+        for work in self.queues.values():
+            work.put(None)
+        for flusher in self.flushers:
+            flusher.join()
+
+
+def cluster_writing(cluster, commands, batch_size, max_queued=2):
+    writer = ClusterWriter(cluster, batch_size, max_queued)
+    try:
+        for command in commands:
+            writer.write(command)
+    except redis.exceptions.RedisError as e:
+        print(f"Failed to write to the cluster. Error: {str(e)}")
+        increment_counter("unsuccessful_write")
+    finally:
+        writer.close()
+
+
+def run_cluster_writers(cluster, partitions, args):
+    if len(partitions) + 1 > args.max_connections:
+        print(f"Warning: {len(partitions)} writers and a verifier need more than {args.max_connections} connections per node")
+
+    write_threads = [
+        threading.Thread(
+            target=cluster_writing,
+            args=(cluster, partition_commands(partition, args), args.batch_size, args.max_inflight_batches)
+        )
+        for partition in partitions
+    ]
+
+    for write_thread in write_threads:
+        write_thread.start()
+
+    for write_thread in write_threads:
+        write_thread.join()
+
+    return [("cluster", f"{args.batch_size} per node (fixed)")]
+
+
+# Protocol files hold the same RESP encoding as the raw engine, so they can be
+# streamed into redis-cli --pipe. Parts are split on whole commands by their
+# uncompressed size, and gzip parts carry no timestamp so that a seeded export
+# is byte-for-byte reproducible.
+class ProtocolFileWriter:
+    def __init__(self, path, split_bytes=0, use_gzip=False):
+        if use_gzip and not path.endswith(".gz"):
+            path += ".gz"
+        self.path = path
+        self.split_bytes = split_bytes
+        self.use_gzip = use_gzip
+        self.paths = []
+        self.file = None
+        self.compressed = None
+        self.part_bytes = 0
+        self.total_bytes = 0
+        self.commands = 0
+        self.record = bytearray()
+
+    def _part_path(self, index):
+        if not self.split_bytes:
+            return self.path
+        directory, name = os.path.split(self.path)
+        stem, dot, extension = name.partition(".")
+        return os.path.join(directory, f"{stem}-{index:04d}{dot}{extension}")
+
+    def _open_part(self):
+        self.close()
+        path = self._part_path(len(self.paths) + 1)
+        self.file = open(path, "wb", buffering=1 << 20)
+        if self.use_gzip:
+            self.compressed = gzip.GzipFile(filename="", mode="wb", fileobj=self.file, mtime=0)
+        self.paths.append(path)
+        self.part_bytes = 0
+
+    def write(self, command):
+        self.record.clear()
+        append_resp_command(self.record, command)
+        if self.file is None or (self.split_bytes and self.part_bytes and self.part_bytes + len(self.record) > self.split_bytes):
+            self._open_part()
+
+        (self.compressed or self.file).write(self.record)
+        self.part_bytes += len(self.record)
+        self.total_bytes += len(self.record)
+        self.commands += 1
+
+    def close(self):
+        if self.compressed is not None:
+            self.compressed.close()
+            self.compressed = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def export_protocol(path, commands, split_bytes=0, use_gzip=False):
+    start = time.perf_counter()
+    writer = ProtocolFileWriter(path, split_bytes, use_gzip)
+    try:
+        for command in commands:
+            writer.write(command)
+            if writer.commands % 10000 == 0:
+                print(f"\rExported commands: {writer.commands}", end="", flush=True)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\rExported {writer.commands} commands ({writer.total_bytes / (1024 * 1024):.1f} MB of RESP) to {len(writer.paths)} file(s) in {elapsed:.2f}s")
+    reader = "zcat" if use_gzip else "cat"
+    for part_path in writer.paths:
+        print(f"  {reader} {part_path} | redis-cli --pipe")
+
+
+def export_commands(args):
+    yield ft_create_command()
+    yield from partition_commands(plan_partitions(args, 1)[0], args)
+
+
+def partition_writers(max_books, max_random, writers, first_id=1):
+    id_count = max_random - first_id + 1
+    writers = max(1, min(writers, id_count))
+    partitions = []
+    for index in range(writers):
+        books = max_books // writers + (1 if index < max_books % writers else 0)
+        slice_first_id = first_id + index * id_count // writers
+        slice_last_id = first_id + (index + 1) * id_count // writers - 1
+        partitions.append((books, slice_first_id, slice_last_id))
+    return partitions
+
+
+def partition_records(records, parts, start=0):
+    parts = max(1, min(parts, records))
+    return [
+        (start + index * records // parts, start + (index + 1) * records // parts)
+        for index in range(parts)
+    ]
+
+
+def plan_partitions(args, parts, parent=None):
+    if args.snapshot:
+        if parent is None:
+            _, records = open_snapshot(args.snapshot)
+            parent = (0, records)
+        start, end = parent
+        return partition_records(end - start, parts, start)
+
+    if parent is None:
+        return partition_writers(args.max_books, args.max_random, parts)
+    books, first_id, last_id = parent
+    return partition_writers(books, last_id, parts, first_id)
+
+
+CHECKPOINT_VERSION = 3
+CHECKPOINT_OPTIONS = (
+    "max_books", "max_random", "writers", "processes", "snapshot", "generator", "block_size", "seed",
+    "key_distribution", "key_zipf_exponent", "hot_key_fraction", "hot_write_share", "overwrite_ratio",
+)
+
+
+def checkpoint_options(args):
+    return {name: getattr(args, name) for name in CHECKPOINT_OPTIONS}
+
+
+def checkpoint_paths(args):
+    if args.processes == 1:
+        return [args.checkpoint]
+    return [f"{args.checkpoint}.{slot}" for slot in range(len(plan_partitions(args, args.processes)))]
+
+
+def read_checkpoint(path, args):
+    with open(path) as f:
+        state = json.load(f)
+    if state.get("version") != CHECKPOINT_VERSION or state.get("options") != checkpoint_options(args):
+        raise ValueError(f"{path} was saved by a load with different options")
+    return state
+
+
+def process_args(args, slot):
+    if not args.checkpoint:
+        return args
+    return argparse.Namespace(**dict(vars(args), checkpoint=f"{args.checkpoint}.{slot}"))
+
+
+class LoadCheckpoint:
+    # Progress of this process's writers for --checkpoint. Generated books are
+    # saved at block granularity: the next block each writer has to generate,
+    # the generation seed and timestamp bound and, with --overwrite-ratio, the
+    # bitmap of IDs flushed before that block. --resume restarts each writer
+    # at its block and regenerates the same books an uninterrupted run would
+    # write; snapshot loads restart at the exact record. The file is replaced atomically every
+    # interval and once the writers finish. Books flushed after the last saved
+    # block are written again.
+    def __init__(self, path, args, writers):
+        self.path = path
+        self.options = checkpoint_options(args)
+        self.block_size = args.block_size
+        self.seed = args.seed if args.seed is not None else random.randrange(2 ** 63)
+        self.timestamp_end = TIMESTAMP_END if TIMESTAMP_END is not None else int(time.time())
+        self.done = [0] * writers
+        self.batches = [0] * writers
+        self.totals = [None] * writers
+        self.first_ids = [None] * writers
+        self.bitmaps = [None] * writers
+        self.pending = [[] for _ in range(writers)]
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def resume(self, args):
+        state = read_checkpoint(self.path, args)
+        writers = state["writers"]
+        if len(writers) != len(self.done):
+            raise ValueError(f"{self.path} holds {len(writers)} writers, this process runs {len(self.done)}")
+        self.seed = state["seed"]
+        self.timestamp_end = state["timestamp_end"]
+        for index, writer in enumerate(writers):
+            self.done[index] = writer["done"]
+            self.batches[index] = writer["batch"] or 0
+            if writer["bitmap"] is not None:
+                self.bitmaps[index] = bytearray(base64.b64decode(writer["bitmap"]))
+
+    def resume_position(self, index):
+        return min(self.batches[index] * self.block_size, self.totals[index])
+
+    def progress(self, index):
+        def flushed(keys):
+            with self.lock:
+                first_id = self.first_ids[index]
+                if first_id is None:
+                    self.done[index] += len(keys)
+                    return
+                # Bits first set inside the current block are undone if the
+                # checkpoint has to be saved before the block completes.
+                bitmap = self.bitmaps[index]
+                pending = self.pending[index]
+                for key in keys:
+                    offset = int(key.rsplit(":", 1)[1]) - first_id
+                    if not bitmap[offset >> 3] >> (offset & 7) & 1:
+                        bitmap[offset >> 3] |= 1 << (offset & 7)
+                        pending.append(offset)
+                    self.done[index] += 1
+                    if self.done[index] % self.block_size == 0:
+                        pending.clear()
+        return flushed
+
+    def sampler(self, index, books, first_id, last_id):
+        self.totals[index] = books
+        self.done[index] = self.resume_position(index)
+        sampler = key_sampler(first_id, last_id)
+        ids = sampler.sampler if isinstance(sampler, IdAllocator) else sampler
+        ids.next_sequential = first_id + self.done[index] % ids.id_count
+        if isinstance(sampler, IdAllocator):
+            if self.bitmaps[index] is None:
+                self.bitmaps[index] = bytearray(len(sampler.bitmap))
+            sampler.bitmap = bytearray(self.bitmaps[index])
+            sampler.written = bin(int.from_bytes(sampler.bitmap, "little")).count("1")
+            self.first_ids[index] = first_id
+        return sampler
+
+    def save(self):
+        writers = []
+        with self.lock:
+            for index, done in enumerate(self.done):
+                bitmap = self.bitmaps[index]
+                batch = None
+                total = self.totals[index]
+                if total is not None:
+                    if done < total:
+                        done -= done % self.block_size
+                        if bitmap is not None:
+                            bitmap = bytearray(bitmap)
+                            for offset in self.pending[index]:
+                                bitmap[offset >> 3] &= ~(1 << (offset & 7))
+                    batch = -(-done // self.block_size)
+                if bitmap is not None:
+                    bitmap = base64.b64encode(bytes(bitmap)).decode()
+                writers.append({"done": done, "batch": batch, "bitmap": bitmap})
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"version": CHECKPOINT_VERSION, "options": self.options, "seed": self.seed, "timestamp_end": self.timestamp_end, "writers": writers}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def saving(self, interval):
+        while not self.stop_event.wait(interval):
+            try:
+                self.save()
+            except OSError as e:
+                print(f"Failed to save checkpoint {self.path}. Error: {str(e)}")
+
+    def start(self, interval):
+        self.thread = threading.Thread(target=self.saving, args=(interval,))
+        self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.save()
+
+
+def run_writers(connection_pool, partitions, args):
+    global TIMESTAMP_END
+    if args.server_side:
+        run_server_side_writers(connection_pool, partitions, args)
+        return []
+    if args.use_async:
+        return run_async_writers(partitions, args)
+    if args.raw_resp:
+        return run_raw_resp_writers(partitions, args)
+    if args.cluster:
+        return run_cluster_writers(connection_pool, partitions, args)
+
+    helpers = 2 if args.ttl_fraction > 0 else 1
+    if len(partitions) + helpers > connection_pool.max_connections:
+        print(f"Warning: {len(partitions)} writers and {helpers} helper connections need more than {connection_pool.max_connections} connections")
+
+    tuners = []
+    if args.batch_size > 1:
+        tuners = [
+            BatchSizeTuner(args.batch_size, args.max_batch_latency / 1000.0, adaptive=not args.fixed_batch_size)
+            for _ in partitions
+        ]
+
+    schedule = WriteSchedule(args.write_rate / args.processes) if args.write_rate else None
+    ttl = None
+    if args.ttl_fraction > 0:
+        ttl = TtlChurn(connection_pool, args.ttl_fraction, args.ttl_seconds, args.ttl_spread, args.ttl_wave_period)
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = LoadCheckpoint(args.checkpoint, args, len(partitions))
+        if args.resume:
+            try:
+                checkpoint.resume(args)
+            except (OSError, ValueError) as e:
+                print(f"Cannot resume from {args.checkpoint}. Error: {str(e)}")
+                if ttl is not None:
+                    ttl.close()
+                return []
+        checkpoint.start(args.checkpoint_interval)
+        TIMESTAMP_END = checkpoint.timestamp_end
+    seed = checkpoint.seed if checkpoint is not None else args.seed
+    write_threads = []
+    for index, partition in enumerate(partitions):
+        tuner = tuners[index] if tuners else None
+        progress = checkpoint.progress(index) if checkpoint is not None else None
+        if args.snapshot:
+            start, end = partition
+            done = checkpoint.done[index] if checkpoint is not None else 0
+            write_threads.append(threading.Thread(
+                target=loading_snapshot,
+                args=(connection_pool, args.snapshot, start + done, end, tuner, args.max_inflight_batches, schedule, ttl, progress)
+            ))
+        else:
+            books, first_id, last_id = partition
+            sampler = None
+            start = 0
+            if checkpoint is not None:
+                sampler = checkpoint.sampler(index, books, first_id, last_id)
+                start = checkpoint.resume_position(index)
+            write_threads.append(threading.Thread(
+                target=generating_books,
+                args=(
+                    connection_pool, books, last_id, tuner, first_id,
+                    args.generator, args.block_size, args.max_inflight_batches, schedule, ttl, sampler, progress, seed, start
+                )
+            ))
+
+    for write_thread in write_threads:
+        write_thread.start()
+
+    try:
+        for write_thread in write_threads:
+            write_thread.join()
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    if ttl is not None:
+        ttl.close()
+
+    if schedule is not None:
+        record_write_latencies(f"{args.write_rate:g} writes/sec", schedule.latencies)
+    return [(f"writer {index + 1}", tuner.report()) for index, tuner in enumerate(tuners)]
+
+
+def publish_counters(shared_counters, shared_p99, slot, stop_event, interval=0.2):
+    offset = slot * len(COUNTER_NAMES)
+    rolling = RollingLatency()
+    while True:
+        finished = stop_event.wait(interval)
+        counters = get_counters_snapshot()
+        for index, name in enumerate(COUNTER_NAMES):
+            shared_counters[offset + index] = counters[name]
+        shared_p99[slot] = rolling.update() or 0
+        if finished:
+            return
+
+
+def populate_process(slot, shared_counters, shared_p99, results, partitions, args):
+    # Runs in a spawned child: it has its own Faker instance and connection pool
+    # and mirrors its local counters into its slot of the shared array.
+    global TIMESTAMP_END
+
+    batch_reports = []
+    stop_event = threading.Event()
+    publisher = threading.Thread(target=publish_counters, args=(shared_counters, shared_p99, slot, stop_event))
+    publisher.start()
+    try:
+        use_vocabulary_pool(args, verbose=False)
+        use_text_generator(args, verbose=False)
+        use_key_distribution(args)
+        if args.seed is not None:
+            random.seed(args.seed + slot)
+            fake.seed_instance(args.seed + slot)
+            TIMESTAMP_END = SEEDED_TIMESTAMP_END
+        connection_pool = create_pool_from_args(args)
+        batch_reports = run_writers(connection_pool, partitions, args)
+    except redis.exceptions.ConnectionError as e:
+        print(f"\nProcess {slot + 1} failed to generate books. Error: {str(e)}")
+    finally:
+        stop_event.set()
+        publisher.join()
+        with COUNTERS_LOCK:
+            write_latencies = list(WRITE_LATENCIES)
+        results.put((slot, batch_reports, write_latencies, list(merged_latency_histograms().items())))
+
+
+def run_processes(args):
+    global SHARED_COUNTERS, SHARED_ROLLING_P99
+
+    # spawn rather than fork: the parent already runs threads holding COUNTERS_LOCK
+    context = multiprocessing.get_context("spawn")
+    process_partitions = plan_partitions(args, args.processes)
+    shared_counters = context.Array("q", len(process_partitions) * len(COUNTER_NAMES), lock=False)
+    shared_p99 = context.Array("q", len(process_partitions), lock=False)
+    with COUNTERS_LOCK:
+        SHARED_COUNTERS = shared_counters
+        SHARED_ROLLING_P99 = shared_p99
+    results = context.Queue()
+
+    workers = [
+        context.Process(
+            target=populate_process,
+            args=(slot, shared_counters, shared_p99, results, plan_partitions(args, args.writers, partition), process_args(args, slot))
+        )
+        for slot, partition in enumerate(process_partitions)
+    ]
+    for worker in workers:
+        worker.start()
+
+    batch_reports = {}
+    while len(batch_reports) < len(workers):
+        try:
+            slot, reports, write_latencies, histograms = results.get(timeout=1)
+            batch_reports[slot] = reports
+            for label, latencies in write_latencies:
+                record_write_latencies(label, latencies)
+            with COUNTERS_LOCK:
+                LATENCY_HISTOGRAMS.extend(histograms)
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in workers) and results.empty():
+                break
+
+    for worker in workers:
+        worker.join()
+
+    fold_shared_counters()
+    return [
+        (f"process {slot + 1} {label}", report)
+        for slot in sorted(batch_reports)
+        for label, report in batch_reports[slot]
+    ]
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Running the book store application v2.1")
+    arg_parser.add_argument("command", nargs="?", default="run", choices=["run", "generate", "export"], help="run populates Redis; generate only writes --snapshot; export writes a redis-cli --pipe protocol file")
+    arg_parser.add_argument("--redis", default="redis://localhost:6379", dest="redis_url", help="Redis URL to connect to.")
+    arg_parser.add_argument("--max-connections", default=10, type=int, dest="max_connections", help="Maximum number of Redis connections.")
+    arg_parser.add_argument("--max-books", default=3000, type=int, dest="max_books", help="Maximum number of books")
+    arg_parser.add_argument("--max-random", default=3000, type=int, dest="max_random", help="Maximum random number of books")
+    arg_parser.add_argument("--flush", action="store_true", help="Flush the Redis database on startup")
+    arg_parser.add_argument("--verify-sleep", default=0.05, type=float, dest="verify_sleep", help="Sleep time in seconds between verification queries")
+    arg_parser.add_argument("--batch-size", default=None, type=int, dest="batch_size", help=f"Initial pipeline depth for batched writes (default 1, which disables pipelining, or {CLUSTER_BATCH_SIZE} per node with --cluster)")
+    arg_parser.add_argument("--max-batch-latency", default=100.0, type=float, dest="max_batch_latency", help="Per-batch latency ceiling in milliseconds used when adapting the batch size")
+    arg_parser.add_argument("--fixed-batch-size", action="store_true", dest="fixed_batch_size", help="Keep --batch-size constant instead of adapting it")
+    arg_parser.add_argument("--writers", default=1, type=int, help="Number of writer threads, each owning a disjoint slice of the book ID space")
+    arg_parser.add_argument("--processes", default=1, type=int, help="Number of writer processes, each with its own Faker instance, connection pool and --writers threads")
+    arg_parser.add_argument("--async", action="store_true", dest="use_async", help="Write from one asyncio event loop per process instead of --writers threads")
+    arg_parser.add_argument("--async-concurrency", default=64, type=int, dest="async_concurrency", help="Writes (or pipelines of --batch-size) the asyncio engine keeps in flight on each connection")
+    arg_parser.add_argument("--async-connections", default=1, type=int, dest="async_connections", help="Connections the asyncio engine spreads its in-flight writes over")
+    arg_parser.add_argument("--raw-resp", action="store_true", dest="raw_resp", help="Write pre-encoded RESP over a plain socket per writer and only count replies (ingest upper bound)")
+    arg_parser.add_argument("--raw-buffer-kb", default=256, type=int, dest="raw_buffer_kb", help="Send buffer size in KB for --raw-resp")
+    arg_parser.add_argument("--write-rate", default=0, type=float, dest="write_rate", help="Target writes/sec across all writers and processes, paced open-loop (0 writes as fast as possible)")
+    arg_parser.add_argument("--server-side", action="store_true", dest="server_side", help="Load a FUNCTION library that generates and writes the books in Redis; writers only send FCALL batches of IDs")
+    arg_parser.add_argument("--server-side-batch", default=100, type=int, dest="server_side_batch", help="Books generated per FCALL; larger batches block the server for longer")
+    arg_parser.add_argument("--compare-client-side", action="store_true", dest="compare_client_side", help="With --server-side, run the client-side HSET load first and report both")
+    arg_parser.add_argument("--cluster", action="store_true", help="Connect with RedisCluster and flush slot-grouped pipelines to every primary in parallel")
+    arg_parser.add_argument("--visibility-probe-rate", default=0, type=float, dest="visibility_probe_rate", help="Marker books written per second to measure write-to-searchable lag (0 disables the probe)")
+    arg_parser.add_argument("--visibility-poll-ms", default=5.0, type=float, dest="visibility_poll_ms", help="Interval between FT.SEARCH polls for pending markers")
+    arg_parser.add_argument("--visibility-timeout", default=10.0, type=float, dest="visibility_timeout", help="Seconds after which a marker that is not searchable is counted as missed")
+    arg_parser.add_argument("--ttl-fraction", default=0, type=float, dest="ttl_fraction", help="Fraction of the written books given a TTL with PEXPIREAT once flushed (threaded engine only)")
+    arg_parser.add_argument("--ttl-seconds", default=60.0, type=float, dest="ttl_seconds", help="Seconds after the write at which a TTL'd book expires")
+    arg_parser.add_argument("--ttl-spread", default=0, type=float, dest="ttl_spread", help="Random extra seconds (0 to this) added to each TTL to spread expiries out")
+    arg_parser.add_argument("--ttl-wave-period", default=0, type=float, dest="ttl_wave_period", help="Round expiries up to a multiple of this many seconds so TTL'd books expire in mass waves (0 disables waves)")
+    arg_parser.add_argument("--update-count", default=0, type=int, dest="update_count", help="Partial updates of existing books sent by --writers threads after the load (0 disables updates)")
+    arg_parser.add_argument("--update-mix", default=DEFAULT_UPDATE_MIX, dest="update_mix", help="Weighted update mix as name=weight pairs; full rewrites the whole hash as the baseline")
+    arg_parser.add_argument("--update-rate", default=0, type=float, dest="update_rate", help="Updates/sec across the update threads, paced open-loop (0 updates as fast as possible)")
+    arg_parser.add_argument("--orders", default=0, type=int, help="Orders placed by --writers threads after the load, each one MULTI/EXEC transaction (0 disables orders)")
+    arg_parser.add_argument("--order-mode", default="both", choices=["multi", "watch", "both"], dest="order_mode", help="Plain MULTI/EXEC orders, WATCH-based optimistic orders, or both on alternating threads")
+    arg_parser.add_argument("--order-retries", default=10, type=int, dest="order_retries", help="Retries of an order whose WATCHed book changed before EXEC")
+    arg_parser.add_argument("--churn-rate", default=0, type=float, dest="churn_rate", help="Books deleted per second, picked by --key-distribution, after the load (0 disables churn)")
+    arg_parser.add_argument("--churn-seconds", default=60.0, type=float, dest="churn_seconds", help="How long to keep deleting and relisting books")
+    arg_parser.add_argument("--churn-relist-delay", default=1.0, type=float, dest="churn_relist_delay", help="Seconds a deleted book stays delisted before it is written back")
+    arg_parser.add_argument("--monitor-interval", default=0, type=float, dest="monitor_interval", help="Seconds between index monitor samples of throughput, expiries, FT.INFO num_docs and query latency (0 samples every second with --ttl-fraction, --update-count, --orders or --churn-rate, otherwise disables the monitor)")
+    arg_parser.add_argument("--monitor-linger", default=0, type=float, dest="monitor_linger", help="Seconds to keep verifying and monitoring after the writers finish, e.g. to watch expired books leave the index")
+    arg_parser.add_argument("--generator", default="faker", choices=["faker", "numpy"], help="Book generator: one Faker/random call per field, or NumPy blocks of --block-size books")
+    arg_parser.add_argument("--block-size", default=1000, type=int, dest="block_size", help="Books generated per NumPy block")
+    arg_parser.add_argument("--vocab-pool-size", default=0, type=int, dest="vocab_pool_size", help="Values per Faker field to pre-build and sample from (0 calls Faker for every book)")
+    arg_parser.add_argument("--vocab-seed", default=0, type=int, dest="vocab_seed", help="Seed used to build the vocabulary pool")
+    arg_parser.add_argument("--vocab-locale", default="en_US", dest="vocab_locale", help="Faker locale used to build the vocabulary pool")
+    arg_parser.add_argument("--vocab-cache-dir", default=".vocab_cache", dest="vocab_cache_dir", help="Directory holding cached vocabulary pools")
+    arg_parser.add_argument("--text-generator", default="faker", choices=["faker", "zipf"], dest="text_generator", help="Source of description and title text")
+    arg_parser.add_argument("--zipf-vocab-size", default=50000, type=int, dest="zipf_vocab_size", help="Number of distinct terms in the Zipf vocabulary")
+    arg_parser.add_argument("--zipf-exponent", default=1.0, type=float, dest="zipf_exponent", help="Zipf exponent; term rank r is drawn with weight 1 / (r + 1) ** exponent")
+    arg_parser.add_argument("--zipf-hot-terms", default="", dest="zipf_hot_terms", help="Comma-separated terms placed at the top Zipf ranks, in order (e.g. green,kingdom)")
+    arg_parser.add_argument("--zipf-terms-file", default=None, dest="zipf_terms_file", help="Write the rank, term, probability and expected posting-list size table to this CSV file")
+    arg_parser.add_argument("--description-min-words", default=150, type=int, dest="description_min_words", help="Minimum words per Zipf description")
+    arg_parser.add_argument("--description-max-words", default=500, type=int, dest="description_max_words", help="Maximum words per Zipf description")
+    arg_parser.add_argument("--key-distribution", default="uniform", choices=["uniform", "sequential", "zipf", "hotspot"], dest="key_distribution", help="How each writer picks book IDs within its slice of the ID space; zipf and hotspot rank the whole ID space once and deal the hot IDs round-robin over the writers' slices")
+    arg_parser.add_argument("--key-zipf-exponent", default=1.0, type=float, dest="key_zipf_exponent", help="Zipf exponent for --key-distribution zipf; the first ID of each writer's slice holds one of the hottest ranks")
+    arg_parser.add_argument("--hot-key-fraction", default=0.01, type=float, dest="hot_key_fraction", help="Fraction of the ID space treated as hot keys by --key-distribution hotspot")
+    arg_parser.add_argument("--hot-write-share", default=0.9, type=float, dest="hot_write_share", help="Fraction of writes sent to the hot keys by --key-distribution hotspot")
+    arg_parser.add_argument("--overwrite-ratio", default=None, type=float, dest="overwrite_ratio", help="Share of the generated books that overwrite an ID written earlier in the run, tracked with a bitmap per writer (default leaves it to --key-distribution)")
+    arg_parser.add_argument("--snapshot", default=None, help="Snapshot file written by generate and replayed by run instead of generating books")
+    arg_parser.add_argument("--export", default=None, dest="export_path", help="Protocol file written by export (FT.CREATE followed by the books, or the --snapshot records)")
+    arg_parser.add_argument("--export-split-mb", default=0, type=float, dest="export_split_mb", help="Start a new numbered export file once this many MB of RESP were written (0 writes one file)")
+    arg_parser.add_argument("--export-gzip", action="store_true", dest="export_gzip", help="Gzip the export files")
+    arg_parser.add_argument("--seed", default=None, type=int, help="Seed for random and Faker, making generate reproducible")
+    arg_parser.add_argument("--checkpoint", default=None, help="File the threaded run saves each writer's progress to, suffixed with the process slot under --processes")
+    arg_parser.add_argument("--checkpoint-interval", default=10.0, type=float, dest="checkpoint_interval", help="Seconds between checkpoint saves")
+    arg_parser.add_argument("--resume", action="store_true", help="Continue the load recorded in --checkpoint instead of starting over")
+    arg_parser.add_argument("--max-inflight-batches", default=2, type=int, dest="max_inflight_batches", help="Batches generated ahead of each writer on a producer thread (0 generates inline)")
+    args = arg_parser.parse_args()
+    if args.generator == "numpy" and numpy is None:
+        arg_parser.error("--generator numpy requires the numpy package")
+    if args.key_zipf_exponent <= 0:
+        arg_parser.error("--key-zipf-exponent must be positive")
+    if args.overwrite_ratio is not None and not 0 <= args.overwrite_ratio <= 1:
+        arg_parser.error("--overwrite-ratio must be in [0, 1]")
+    if not 0 < args.hot_key_fraction <= 1 or not 0 <= args.hot_write_share <= 1:
+        arg_parser.error("--hot-key-fraction must be in (0, 1] and --hot-write-share in [0, 1]")
+    if args.write_rate and (args.use_async or args.raw_resp):
+        arg_parser.error("--write-rate paces the threaded engine only")
+    if args.cluster and (args.use_async or args.raw_resp or args.write_rate):
+        arg_parser.error("--cluster cannot be combined with --async, --raw-resp or --write-rate")
+    if args.batch_size is None:
+        args.batch_size = CLUSTER_BATCH_SIZE if args.cluster else 1
+    elif args.cluster and args.batch_size == 1:
+        print("Warning: --batch-size 1 sends every command in its own pipeline to its cluster node")
+    if not 0 <= args.ttl_fraction <= 1:
+        arg_parser.error("--ttl-fraction must be in [0, 1]")
+    if args.ttl_seconds < 0 or args.ttl_spread < 0 or args.ttl_wave_period < 0:
+        arg_parser.error("--ttl-seconds, --ttl-spread and --ttl-wave-period cannot be negative")
+    if args.update_count < 0 or args.update_rate < 0:
+        arg_parser.error("--update-count and --update-rate cannot be negative")
+    try:
+        parse_update_mix(args.update_mix)
+    except ValueError as e:
+        arg_parser.error(str(e))
+    if args.orders < 0 or args.order_retries < 0:
+        arg_parser.error("--orders and --order-retries cannot be negative")
+    if args.orders and args.cluster:
+        arg_parser.error("--orders transactions span a book and the order stream, which live in different cluster slots")
+    if args.churn_rate < 0 or args.churn_seconds <= 0 or args.churn_relist_delay < 0:
+        arg_parser.error("--churn-rate and --churn-relist-delay cannot be negative and --churn-seconds must be positive")
+    if args.ttl_fraction and (args.use_async or args.raw_resp or args.cluster):
+        arg_parser.error("--ttl-fraction applies to the threaded engine only")
+    if args.overwrite_ratio is not None and (args.use_async or args.raw_resp or args.cluster):
+        arg_parser.error("--overwrite-ratio counts acknowledged writes, which only the threaded engine and --server-side track")
+    if args.server_side and (args.use_async or args.raw_resp or args.cluster or args.snapshot or args.write_rate or args.ttl_fraction):
+        arg_parser.error("--server-side cannot be combined with --async, --raw-resp, --cluster, --snapshot, --write-rate or --ttl-fraction")
+    if args.server_side_batch < 1:
+        arg_parser.error("--server-side-batch must be at least 1")
+    if args.resume and not args.checkpoint:
+        arg_parser.error("--resume requires --checkpoint")
+    if args.checkpoint and (args.command != "run" or args.use_async or args.raw_resp or args.cluster or args.server_side):
+        arg_parser.error("--checkpoint applies to a single threaded run pass only")
+    if args.checkpoint_interval <= 0:
+        arg_parser.error("--checkpoint-interval must be positive")
+    if args.resume and args.flush:
+        arg_parser.error("--resume continues the books already loaded, so it cannot be combined with --flush")
+    if args.raw_resp and args.use_async:
+        arg_parser.error("--raw-resp and --async are separate engines")
+    if args.async_concurrency < 1 or args.async_connections < 1:
+        arg_parser.error("--async-concurrency and --async-connections must be at least 1")
+    if args.raw_resp and not args.redis_url.startswith("redis://"):
+        arg_parser.error("--raw-resp supports plain redis:// URLs only")
+    if args.command == "generate" and not args.snapshot:
+        arg_parser.error("generate requires --snapshot")
+    if args.command == "export" and not args.export_path:
+        arg_parser.error("export requires --export")
+    if args.command in ("run", "export") and args.snapshot:
+        try:
+            open_snapshot(args.snapshot)
+        except (OSError, ValueError) as e:
+            arg_parser.error(str(e))
+
+    if args.resume:
+        try:
+            states = [read_checkpoint(path, args) for path in checkpoint_paths(args)]
+        except (OSError, ValueError) as e:
+            arg_parser.error(str(e))
+        resumed = sum(writer["done"] for state in states for writer in state["writers"])
+        print(f"Resuming from {args.checkpoint}: {resumed} books already written")
+
+    use_vocabulary_pool(args)
+    use_text_generator(args)
+    use_key_distribution(args)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        fake.seed_instance(args.seed)
+        TIMESTAMP_END = SEEDED_TIMESTAMP_END
+
+    if args.command == "generate":
+        write_snapshot(args.snapshot, args.max_books, args.max_random, args.generator, args.block_size)
+        raise SystemExit(0)
+
+    if args.command == "export":
+        export_protocol(args.export_path, export_commands(args), int(args.export_split_mb * 1024 * 1024), args.export_gzip)
+        raise SystemExit(0)
+
+    try:
+        print(f"Connecting to Redis at {args.redis_url} with a max of {args.max_connections} connections")
+        redis_pool = create_pool_from_args(args)
+
+        if args.flush:
+            print("Flushing Redis database...")
+            r = redis_client(redis_pool)
+            r.flushall()
+
+        create_search_index(redis_pool)
+        write_data_verification(redis_pool)
+
+        stop_event = threading.Event()
+        status_stop_event = threading.Event()
+
+        verification_thread = threading.Thread(
+            target=read_data_verification,
+            args=(redis_pool, stop_event, args.verify_sleep)
+        )
+        status_thread = threading.Thread(
+            target=print_live_status,
+            args=(status_stop_event,)
+        )
+
+        probe_thread = None
+        if args.visibility_probe_rate > 0:
+            probe_thread = threading.Thread(
+                target=visibility_probe,
+                args=(redis_pool, stop_event, args.visibility_probe_rate, args.visibility_poll_ms / 1000.0, args.visibility_timeout)
+            )
+
+        monitor_thread = None
+        workloads = args.ttl_fraction > 0 or args.update_count > 0 or args.orders > 0 or args.churn_rate > 0
+        monitor_interval = args.monitor_interval or (1.0 if workloads else 0)
+        if monitor_interval > 0:
+            monitor_thread = threading.Thread(
+                target=index_monitor,
+                args=(redis_pool, stop_event, monitor_interval)
+            )
+
+        status_thread.start()
+        verification_thread.start()
+        if probe_thread is not None:
+            probe_thread.start()
+        if monitor_thread is not None:
+            monitor_thread.start()
+
+        load_passes = [args.server_side]
+        if args.server_side and args.compare_client_side:
+            load_passes = [False, True]
+
+        docs_before = indexed_doc_count(redis_pool) if args.overwrite_ratio is not None else None
+        cpu_start = client_cpu_seconds()
+        batch_reports = []
+        for index, server_side in enumerate(load_passes):
+            if index > 0:
+                clear_start = client_cpu_seconds()
+                print(f"Cleared {clear_books(redis_pool)} books written by the previous pass")
+                cpu_start += client_cpu_seconds() - clear_start
+            pass_args = argparse.Namespace(**dict(vars(args), server_side=server_side))
+            label = f"server-side FCALL x{args.server_side_batch}" if server_side else "client-side HSET"
+            writes_start = get_counters_snapshot()
+            sent_start = net_input_bytes(redis_pool)
+            pass_start = time.perf_counter()
+            if args.processes > 1:
+                batch_reports.extend(run_processes(pass_args))
+            else:
+                partitions = plan_partitions(args, args.writers)
+                batch_reports.extend(run_writers(redis_pool, partitions, pass_args))
+            pass_seconds = time.perf_counter() - pass_start
+            sent_end = net_input_bytes(redis_pool)
+            docs = get_counters_snapshot()["successful_write"] - writes_start["successful_write"]
+            sent_bytes = sent_end - sent_start if sent_start is not None and sent_end is not None else None
+            LOAD_PASSES.append((label, docs, pass_seconds, sent_bytes))
+        cpu_seconds = client_cpu_seconds() - cpu_start
+        docs_after = indexed_doc_count(redis_pool) if args.overwrite_ratio is not None else None
+
+        if args.update_count > 0:
+            print(f"\nUpdating {args.update_count} books ({args.update_mix})")
+            run_updaters(redis_pool, args)
+
+        order_seconds = None
+        if args.orders > 0:
+            print(f"\nPlacing {args.orders} orders ({args.order_mode})")
+            order_seconds = run_order_writers(redis_pool, args)
+
+        if args.churn_rate > 0:
+            print(f"\nChurning {args.churn_rate:g} books/sec for {args.churn_seconds:g} seconds")
+            churning(redis_pool, args.max_random, args.churn_rate, args.churn_seconds, args.churn_relist_delay)
+
+        if args.monitor_linger > 0:
+            print(f"\nWriters finished, monitoring for another {args.monitor_linger:g} seconds")
+            time.sleep(args.monitor_linger)
+
         stop_event.set()
         verification_thread.join()
+        if probe_thread is not None:
+            probe_thread.join()
+        if monitor_thread is not None:
+            monitor_thread.join()
 
         status_stop_event.set()
         status_thread.join()
@@ -353,6 +3466,34 @@ if __name__ == "__main__":
         print(f"Error verification: {counters['data_verification_error']}")
         print(f"Successful writes: {counters['successful_write']}")
         print(f"Error writes: {counters['unsuccessful_write']}")
+        if args.overwrite_ratio is not None:
+            print_id_allocation(counters, docs_before, docs_after)
+        if args.key_distribution in ("zipf", "hotspot") and KEY_DISTRIBUTION["ranking"] is not None:
+            slices = len(KEY_DISTRIBUTION["ranking"].slices)
+            print(f"Key distribution: {args.key_distribution}, one hot set dealt round-robin over {slices} writer slices")
+        if args.ttl_fraction > 0:
+            print(f"TTLs set: {counters['ttl_set']}")
+        if args.update_count > 0:
+            print(f"Partial updates: {counters['partial_update']}")
+        if order_seconds is not None:
+            print_order_summary(counters, order_seconds)
+        if args.churn_rate > 0:
+            print(f"Books delisted: {counters['churn_delete']}, relisted: {counters['churn_relist']}")
+        for label, report in batch_reports:
+            print(f"Chosen batch size ({label}): {report}")
+        print_load_passes()
+        print_latency_histograms()
+        print_write_latencies()
+        print_visibility_lags(args.visibility_timeout)
+        print_index_monitor()
+        writes = counters["successful_write"] + counters["unsuccessful_write"]
+        if writes:
+            print(f"Client CPU per write: {cpu_seconds * 1000000 / writes:.1f} us ({cpu_seconds:.2f} s total)")
+        own_peak, children_peak = peak_memory_mb()
+        if own_peak is not None:
+            print(f"Peak client RSS: {own_peak:.1f} MB")
+            if args.processes > 1:
+                print(f"Peak writer process RSS: {children_peak:.1f} MB")
 
     except redis.exceptions.ConnectionError as e:
         print(f"Failed to connect to Redis. Error: {str(e)}")
@@ -33,14 +33,31 @@ from redis.commands.search.aggregation import AggregateRequest
 # Define constants
 REDIS_KEY_BASE = "alon:shmuely:redis:data:store:application"  
 INDEX_NAME = "idx:books"
-DATA_VERIFICATION_SUCCESSFUL = 0
-DATA_VERIFICATION_ERROR = 0
-RANDOM_CMD = 0 
-SUCCESSFUL_WRITE = 0
-UNSUCCESSFUL_WRITE = 0
+COUNTER_NAMES = ["data_verification_successful", "data_verification_error", "random_cmd", "successful_write", "unsuccessful_write"]
+COUNTER_SLOTS = []
+COUNTER_SLOTS_LOCK = threading.Lock()
+COUNTER_LOCAL = threading.local()
 
 fake = Faker()
 
+def increment_counter(name, amount=1):
+    # Each thread counts into its own slot, which only it ever writes
+    slot = getattr(COUNTER_LOCAL, "slot", None)
+    if slot is None:
+        slot = COUNTER_LOCAL.slot = dict.fromkeys(COUNTER_NAMES, 0)
+        with COUNTER_SLOTS_LOCK:
+            COUNTER_SLOTS.append(slot)
+    slot[name] += amount
+
+def get_counters_snapshot():
+    with COUNTER_SLOTS_LOCK:
+        slots = list(COUNTER_SLOTS)
+    snapshot = dict.fromkeys(COUNTER_NAMES, 0)
+    for slot in slots:
+        for name in COUNTER_NAMES:
+            snapshot[name] += slot[name]
+    return snapshot
+
 def make_key(book_id):
     return f"{REDIS_KEY_BASE}:{book_id}"
 
@@ -172,11 +189,12 @@ def generate_random_book(id):
     
 def print_live_status(stop_event):
    while not stop_event.is_set():
-       print(f"\rCurrent Status - Successful Verification: {DATA_VERIFICATION_SUCCESSFUL}, "
-              f"Error Verification: {DATA_VERIFICATION_ERROR}, "
-              f"Random Commands: {RANDOM_CMD}, "
-              f"Successful Writes: {SUCCESSFUL_WRITE}, "
-              f"Unsuccessful Writes: {UNSUCCESSFUL_WRITE}", end='', flush=True)
+       counters = get_counters_snapshot()
+       print(f"\rCurrent Status - Successful Verification: {counters['data_verification_successful']}, "
+              f"Error Verification: {counters['data_verification_error']}, "
+              f"Random Commands: {counters['random_cmd']}, "
+              f"Successful Writes: {counters['successful_write']}, "
+              f"Unsuccessful Writes: {counters['unsuccessful_write']}", end='', flush=True)
        time.sleep(1) 
        
 def write_data_verification(connection_pool):
@@ -191,22 +209,19 @@ def write_data_verification(connection_pool):
        print(f"Failed to write data verification. Error: {str(e)}")
        
 def read_data_verification(connection_pool, stop_event):
-   global DATA_VERIFICATION_SUCCESSFUL 
-   global DATA_VERIFICATION_ERROR
    try:
       r = redis.Redis(connection_pool=connection_pool)
       while not stop_event.is_set():
           R2 = r.ft(INDEX_NAME).search(Query("Shmuely").return_field("$.title")).docs
           if R2 and R2[0]['$.title'] == "QA architect":
-              DATA_VERIFICATION_SUCCESSFUL += 1
+              increment_counter("data_verification_successful")
           else:
-              DATA_VERIFICATION_ERROR += 1
+              increment_counter("data_verification_error")
    except (IndexError, redis.exceptions.ConnectionError) as e:
       print(f"Data verification failed. Error: {str(e)}")
       write_data_verification()
       
 def random_commands(connection_pool, stop_event):
-    global RANDOM_CMD
     try:
         r4 = redis.Redis(connection_pool=connection_pool)
         alias_name = f"{INDEX_NAME}_alias"
@@ -248,26 +263,35 @@ def random_commands(connection_pool, stop_event):
           random_command = random.choice(commands)
           random_command()  
 
-          RANDOM_CMD += 1
+          increment_counter("random_cmd")
     except (IndexError, redis.exceptions.ConnectionError) as e:
         print(f"random command request failed. Error: {str(e)}")
         
-def generating_books(connection_pool, max_books, max_random):
-    global SUCCESSFUL_WRITE 
-    global UNSUCCESSFUL_WRITE
+def generating_books(connection_pool, max_books, max_random, first_id=1):
     try:
         r = redis.Redis(connection_pool=connection_pool)
         for x in range(1, max_books + 1):
-            book_id = random.randint(1, max_random)
+            book_id = random.randint(first_id, max_random)
             book_data = generate_random_book(book_id)
             response = r.json().set("alon:shmuely:redis:data:store:application:" + str(book_id), Path.root_path(), book_data)
             if response:
-              SUCCESSFUL_WRITE += 1
+              increment_counter("successful_write")
             else:
-              UNSUCCESSFUL_WRITE += 1
+              increment_counter("unsuccessful_write")
     except redis.exceptions.ConnectionError as e:
         print(f"Failed to generate books. Error: {str(e)}")
 
+def partition_writers(max_books, max_random, writers):
+    # Every writer gets its share of the books and a disjoint slice of the ID space
+    writers = max(1, min(writers, max_random))
+    partitions = []
+    for index in range(writers):
+        books = max_books // writers + (1 if index < max_books % writers else 0)
+        first_id = index * max_random // writers + 1
+        last_id = (index + 1) * max_random // writers
+        partitions.append((books, first_id, last_id))
+    return partitions
+
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser(description="Running the book store application")
     arg_parser.add_argument("--redis", default="redis://localhost:6379", dest="redis_url", help="Redis URL to connect to.")
@@ -276,6 +300,7 @@ if __name__ == "__main__":
     arg_parser.add_argument("--max-random", default=3000, type=int, dest="max_random", help="Maximum random number of books")
     arg_parser.add_argument("--flush", action='store_true', help="Flush the Redis database on startup")
     arg_parser.add_argument("--run-random-cmds", action='store_true', help="Run random commands thread")
+    arg_parser.add_argument("--writers", default=1, type=int, help="Number of writer threads, each owning a disjoint slice of the book ID space")
     args = arg_parser.parse_args()
 
     try:
@@ -293,7 +318,10 @@ if __name__ == "__main__":
         # Create thread objects
         stop_event = threading.Event()  
         verification_thread = threading.Thread(target=read_data_verification, args=(redis_pool, stop_event))
-        write_thread = threading.Thread(target=generating_books, args=(redis_pool, args.max_books, args.max_random))
+        write_threads = [
+            threading.Thread(target=generating_books, args=(redis_pool, books, last_id, first_id))
+            for books, first_id, last_id in partition_writers(args.max_books, args.max_random, args.writers)
+        ]
         chaos_thread = None
         if args.run_random_cmds:
             chaos_thread = threading.Thread(target=random_commands, args=(redis_pool, stop_event))
@@ -307,11 +335,13 @@ if __name__ == "__main__":
         
         # Start the main threads
         verification_thread.start()
-        write_thread.start()
+        for write_thread in write_threads:
+            write_thread.start()
         if args.run_random_cmds:
             chaos_thread.start()
 
-        write_thread.join()
+        for write_thread in write_threads:
+            write_thread.join()
         stop_event.set() 
         verification_thread.join()
         if args.run_random_cmds:
@@ -321,10 +351,11 @@ if __name__ == "__main__":
         status_stop_event.set() 
         status_thread.join()
 
+        counters = get_counters_snapshot()
         print(f"\n\n\nRun Summary")
-        print(f"Successful verification: {DATA_VERIFICATION_SUCCESSFUL}\nError verification: {DATA_VERIFICATION_ERROR}")
-        print(f"Random commands: {RANDOM_CMD}")
-        print(f"Successful writes: {SUCCESSFUL_WRITE}\nError writes: {UNSUCCESSFUL_WRITE}")
+        print(f"Successful verification: {counters['data_verification_successful']}\nError verification: {counters['data_verification_error']}")
+        print(f"Random commands: {counters['random_cmd']}")
+        print(f"Successful writes: {counters['successful_write']}\nError writes: {counters['unsuccessful_write']}")
 
     except redis.exceptions.ConnectionError as e:
         print(f"Failed to connect to Redis. Error: {str(e)}")